@@ -0,0 +1,306 @@
+import numpy as np
+
+
+################################################################################
+# Bar geometry for the earthquake representation, computed for all events at
+# once. Nothing in here touches the omega runtime so it can be used headless.
+################################################################################
+
+# corners of a bar of unit height and unit half thickness, standing on the
+# origin along +y. named like the v0..v7 of the old per event code
+_CORNERS = np.array([[-1, 0,  1],     # v0
+                     [-1, 1,  1],     # v1
+                     [ 1, 0,  1],     # v2
+                     [ 1, 1,  1],     # v3
+                     [ 1, 0, -1],     # v4
+                     [ 1, 1, -1],     # v5
+                     [-1, 0, -1],     # v6
+                     [-1, 1, -1]],    # v7
+                    np.float64)
+
+# triangle strip wrapping the four sides and the top of the bar
+STRIP = [0, 1, 6, 7, 4, 5, 2, 3, 0, 1, 7, 5, 3, 1]
+BAR_VERTICES = len(STRIP)
+
+
+def barOrientations(x, y, z):
+        # unit quaternions (w, x, y, z) turning +y onto each position, as
+        # euclid's rotate_axis(acos(p.y), (0, 1, 0) x p); the south pole turns
+        # about +x
+        angle = np.arccos(np.clip(y, -1.0, 1.0))
+
+        # (0, 1, 0) x p = (z, 0, -x), normalized
+        length = np.sqrt(z * z + x * x)
+        safe = np.where(length > 0, length, 1.0)
+        ax = np.where(length > 0, z / safe, 1.0)
+        az = np.where(length > 0, -x / safe, 0.0)
+
+        half = angle * 0.5
+        s = np.sin(half)
+        quats = np.empty((len(x), 4), np.float64)
+        quats[:, 0] = np.cos(half)
+        quats[:, 1] = ax * s
+        quats[:, 2] = 0
+        quats[:, 3] = az * s
+        return quats
+
+
+def quatFrames(quats):
+        w = quats[:, 0]
+        x = quats[:, 1]
+        y = quats[:, 2]
+        z = quats[:, 3]
+        frames = np.empty((len(quats), 3, 3), np.float64)
+        frames[:, 0, 0] = 1 - 2 * (y * y + z * z)
+        frames[:, 0, 1] = 2 * (x * y - w * z)
+        frames[:, 0, 2] = 2 * (x * z + w * y)
+        frames[:, 1, 0] = 2 * (x * y + w * z)
+        frames[:, 1, 1] = 1 - 2 * (x * x + z * z)
+        frames[:, 1, 2] = 2 * (y * z - w * x)
+        frames[:, 2, 0] = 2 * (x * z - w * y)
+        frames[:, 2, 1] = 2 * (y * z + w * x)
+        frames[:, 2, 2] = 1 - 2 * (x * x + y * y)
+        return frames
+
+
+def barColors(mag, magMin, magMax, cHigh, cLow):
+        t = (np.asarray(mag, np.float64) - magMin) * (1.0 / (magMax - magMin))
+        colors = np.empty((len(t), 4), np.float32)
+        colors[:, :3] = np.outer(t, cHigh) + np.outer(1 - t, cLow)
+        colors[:, 3] = 1
+        return colors
+
+
+def clusterColors(cluster, mainshock=None):
+        # one hue per cluster spread by the golden ratio, mainshocks brighter
+        hue = (np.asarray(cluster, np.float64) * 0.618033988749895) % 1.0
+        value = np.full(len(hue), 0.75)
+        if mainshock is not None:
+                value[np.asarray(mainshock, bool)] = 1.0
+
+        # hsv to rgb at full saturation
+        h6 = hue * 6
+        x = 1 - np.abs(h6 % 2 - 1)
+        sector = h6.astype(np.intp) % 6
+        rgb = np.zeros((len(hue), 3))
+        table = ((0, 1), (1, 0), (1, 2), (2, 1), (2, 0), (0, 2))
+        for s, (full, part) in enumerate(table):
+                m = sector == s
+                rgb[m, full] = 1
+                rgb[m, part] = x[m]
+
+        colors = np.empty((len(hue), 4), np.float32)
+        colors[:, :3] = rgb * value[:, np.newaxis]
+        colors[:, 3] = 1
+        return colors
+
+
+class BarInstances(object):
+        # a unit bar template plus WIDTH float32 values per event: position,
+        # orientation quaternion, unscaled height and RGBA. The scale is handed
+        # to expand()
+
+        POS = slice(0, 3)
+        ORIENT = slice(3, 7)
+        HEIGHT = 7
+        COLOR = slice(8, 12)
+        WIDTH = 12
+
+        def __init__(self, cols, showByMag, magMin, magMax, cHigh, cLow, thickness=0.005,
+                     colors=None):
+                self.thickness = thickness
+                self.showByMag = showByMag
+                self._depth = cols.depth
+                self._mag = cols.mag
+
+                self.buffer = np.empty((len(cols), BarInstances.WIDTH), np.float32)
+                self.buffer[:, 0] = cols.x
+                self.buffer[:, 1] = cols.y
+                self.buffer[:, 2] = cols.z
+                self.buffer[:, BarInstances.ORIENT] = barOrientations(cols.x, cols.y, cols.z)
+                self.buffer[:, BarInstances.HEIGHT] = self._mag if showByMag else self._depth
+                if colors is None:
+                        colors = barColors(cols.mag, magMin, magMax, cHigh, cLow)
+                self.buffer[:, BarInstances.COLOR] = colors
+
+        def __len__(self):
+                return len(self.buffer)
+
+        def withQuantity(self, showByMag):
+                # a copy unless nothing changes, so handed out buffers stay as they are
+                if showByMag == self.showByMag:
+                        return self
+                inst = BarInstances.__new__(BarInstances)
+                inst.__dict__.update(self.__dict__)
+                inst.showByMag = showByMag
+                inst.buffer = self.buffer.copy()
+                inst.buffer[:, BarInstances.HEIGHT] = self._mag if showByMag else self._depth
+                return inst
+
+        @staticmethod
+        def template(thickness):
+                return _CORNERS[STRIP] * [thickness, 1, thickness]
+
+        def expand(self, scale, start=0, stop=None):
+                # headless backend: the strips of instances [start, stop)
+                buffer = self.buffer[start:stop]
+                n = len(buffer)
+                height = buffer[:, BarInstances.HEIGHT].astype(np.float64) * scale
+
+                if np.ndim(self.thickness) == 0:
+                        local = np.repeat(BarInstances.template(self.thickness)[np.newaxis], n, axis=0)
+                else:
+                        local = np.repeat(BarInstances.template(1.0)[np.newaxis], n, axis=0)
+                        thickness = np.asarray(self.thickness, np.float64)[start:stop]
+                        local[:, :, 0] *= thickness[:, np.newaxis]
+                        local[:, :, 2] *= thickness[:, np.newaxis]
+                local[:, :, 1] *= height[:, np.newaxis]
+
+                frames = quatFrames(buffer[:, BarInstances.ORIENT].astype(np.float64))
+                pos = buffer[:, BarInstances.POS].astype(np.float64)
+                verts = np.einsum("nij,nkj->nki", frames, local) + pos[:, np.newaxis, :]
+                verts = verts.reshape(n * BAR_VERTICES, 3).astype(np.float32)
+
+                colors = np.repeat(buffer[:, BarInstances.COLOR], BAR_VERTICES, axis=0)
+                return verts, colors
+
+
+def cellInstances(stats, showByMag, magMin, magMax, cHigh, cLow):
+        # one column per cell, its width growing with the square root of the
+        # count
+        full = np.radians(stats.cellDeg) / 3
+        most = stats.count.max() if len(stats) else 1
+        thickness = full * np.sqrt(stats.count / float(most))
+        return BarInstances(stats, showByMag, magMin, magMax, cHigh, cLow,
+                            np.maximum(thickness, 0.005))
+
+
+def barMesh(cols, scale, showByMag, magMin, magMax, cHigh, cLow, thickness=0.005):
+        # one strip of BAR_VERTICES per row, in row order
+        inst = BarInstances(cols, showByMag, magMin, magMax, cHigh, cLow, thickness)
+        return inst.expand(scale)
+
+
+class BarRing(object):
+        # bars of a sliding time window in one mesh of capacity strips, new bars
+        # wrapping onto the oldest slots. Bars fade in levels steps with age;
+        # push() and advance() return (first vertex, verts, colors) patches
+
+        def __init__(self, capacity, window, levels=8, dim=0.2):
+                self.capacity = capacity
+                self.window = window
+                self.levels = levels
+                self.dim = dim
+
+                self.verts = np.zeros((capacity * BAR_VERTICES, 3), np.float32)
+                self.colors = np.zeros((capacity * BAR_VERTICES, 4), np.float32)
+                self._base = np.zeros((capacity, 4), np.float32)
+                self._time = np.zeros(capacity, np.float64)
+
+                # live bars are sequence numbers [_first, _next); bar s is
+                # in slot s % capacity
+                self._first = 0
+                self._next = 0
+                self._now = None
+
+        def __len__(self):
+                return self._next - self._first
+
+        def mesh(self):
+                return self.verts.copy(), self.colors.copy()
+
+        def clear(self):
+                patches = self._collapse(self._first, self._next)
+                self._first = self._next
+                self._now = None
+                return patches
+
+        def push(self, inst, times, scale, now=None):
+                # times ascending and not before any bar held; overflow drops the
+                # oldest. The clock only moves with advance()
+                n = len(inst)
+                if n == 0:
+                        return []
+                skip = max(0, n - self.capacity)
+                n -= skip
+                verts, colors = inst.expand(scale, skip)
+
+                first = self._next
+                self._next += n
+                self._first = max(self._first, self._next - self.capacity)
+                for start, stop, offset in self._runs(first, self._next):
+                        rows = slice(skip + offset, skip + offset + stop - start)
+                        self._base[start:stop] = inst.buffer[rows, BarInstances.COLOR]
+                        self._time[start:stop] = times[rows]
+                        vsrc = slice(offset * BAR_VERTICES, (offset + stop - start) * BAR_VERTICES)
+                        self.verts[start * BAR_VERTICES:stop * BAR_VERTICES] = verts[vsrc]
+
+                if self._now is None:
+                        self._now = times[-1] if now is None else now
+                if now is None:
+                        now = self._now
+                return self._recolor(first, self._next, now)
+
+        def advance(self, now):
+                # expires bars older than window and recolors those crossing a step
+                prev = self._now
+                self._now = now
+                if prev is None or now < prev:
+                        return self._recolor(self._first, self._next, now)
+
+                expired = self._search(now - self.window)
+                patches = self._collapse(self._first, expired)
+                self._first = expired
+
+                step = float(self.window) / self.levels
+                for j in range(1, self.levels):
+                        lo = self._search(prev - j * step)
+                        hi = self._search(now - j * step)
+                        patches.extend(self._recolor(lo, hi, now))
+                return patches
+
+        def _search(self, t):
+                # first live sequence number with a time > t
+                lo = self._first
+                hi = self._next
+                while lo < hi:
+                        mid = (lo + hi) // 2
+                        if self._time[mid % self.capacity] <= t:
+                                lo = mid + 1
+                        else:
+                                hi = mid
+                return lo
+
+        def _runs(self, first, stop):
+                # (slot start, slot stop, offset from first) of the at most
+                # two contiguous slot runs holding sequence numbers first..stop-1
+                runs = []
+                s = first
+                while s < stop:
+                        slot = s % self.capacity
+                        count = min(stop - s, self.capacity - slot)
+                        runs.append((slot, slot + count, s - first))
+                        s += count
+                return runs
+
+        def _patch(self, start, stop):
+                vslice = slice(start * BAR_VERTICES, stop * BAR_VERTICES)
+                return (start * BAR_VERTICES, self.verts[vslice].copy(), self.colors[vslice].copy())
+
+        def _recolor(self, first, stop, now):
+                patches = []
+                for start, end, offset in self._runs(first, stop):
+                        age = now - self._time[start:end]
+                        level = np.clip(np.floor(age * self.levels / self.window), 0, self.levels - 1)
+                        shade = 1 - (1 - self.dim) * level / max(1, self.levels - 1)
+                        colors = self._base[start:end] * shade[:, np.newaxis].astype(np.float32)
+                        self.colors[start * BAR_VERTICES:end * BAR_VERTICES] = np.repeat(colors, BAR_VERTICES, axis=0)
+                        patches.append(self._patch(start, end))
+                return patches
+
+        def _collapse(self, first, stop):
+                patches = []
+                for start, end, offset in self._runs(first, stop):
+                        self.verts[start * BAR_VERTICES:end * BAR_VERTICES] = 0
+                        patches.append(self._patch(start, end))
+                return patches
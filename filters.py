@@ -0,0 +1,397 @@
+import numpy as np
+
+from math import *
+from euclid import *
+from qtest import *
+
+
+################################################################################
+# Event filters: a scalar matches() per QEntry and a batch mask() over the
+# columns of the catalog. Nothing in here touches the omega runtime.
+################################################################################
+
+class DefFilter:
+        @classmethod
+        def matches(cls, qentry):
+                pass
+
+        @classmethod
+        def __str__(cls):
+            return "Any"
+
+        # Batch evaluation over a QColumns. idx optionally restricts the
+        # rows looked at (ascending row numbers); masks are then relative
+        # to idx. Subclasses override mask() with a vectorized version of
+        # matches().
+
+        def mask(self, cols, idx=None):
+                rows = np.arange(len(cols)) if idx is None else idx
+                return np.array([bool(self.matches(cols.entry(i))) for i in rows], bool)
+
+        def indices(self, cols, idx=None):
+                m = self.mask(cols, idx)
+                if idx is None:
+                        return np.flatnonzero(m)
+                return idx[m]
+
+        def key(self):
+                # canonical, hashable description of what passes; filters
+                # without one are only equal to themselves
+                return (type(self).__name__, id(self))
+
+        def refines(self, other):
+                # True when everything passing self is known to pass other
+                return other.key() == ("Any",) or other.key() == self.key()
+
+        def selectivity(self, cols):
+                # fraction of a strided sample that passes
+                sample = cols.sample()
+                if len(sample) == 0:
+                        return 1.0
+                return self.mask(cols, sample).mean()
+
+class DefPassFilter(DefFilter):
+
+        @classmethod
+        def matches(cls, qentry):
+                return True
+
+        @classmethod
+        def __str__(cls):
+            return "Any"
+
+        @classmethod
+        def mask(cls, cols, idx=None):
+                return np.ones(len(cols) if idx is None else len(idx), bool)
+
+        @classmethod
+        def indices(cls, cols, idx=None):
+                if idx is None:
+                        return np.arange(len(cols))
+                return idx
+
+        @classmethod
+        def selectivity(cls, cols):
+                return 1.0
+
+        @classmethod
+        def key(cls):
+                return ("Any",)
+
+        @classmethod
+        def refines(cls, other):
+                return other.key() == ("Any",)
+
+class DefCompositeFilter(DefFilter):
+        LOCATION = 0
+        TIME = 1
+        MAGNITUDE = 2
+        ATTRIBUTE = 3
+        CLUSTER = 4
+        _NUMENTRIES = 5
+
+        def __init__(self,
+                     locFilter=DefPassFilter(),
+                     timeFilter=DefPassFilter(),
+                     magFilter=DefPassFilter(),
+                     attrFilter=DefPassFilter(),
+                     clusterFilter=DefPassFilter()):
+
+                    self._filters = [locFilter, timeFilter, magFilter, attrFilter, clusterFilter]
+
+        @staticmethod
+        def QuickByTime(timeFilter):
+                return DefCompositeFilter(DefPassFilter,
+                                          timeFilter,
+                                          DefPassFilter)
+        @staticmethod
+        def QuickByLocation(locationFilter):
+                return DefCompositeFilter(locationFilter)
+
+        @staticmethod
+        def QuickByMagnitude(magnitudeFilter):
+                return DefCompositeFilter(DefPassFilter,
+                                          DefPassFilter,
+                                          magnitudeFilter)
+
+        @staticmethod
+        def QuickByAttribute(attributeFilter):
+                return DefCompositeFilter(DefPassFilter,
+                                          DefPassFilter,
+                                          DefPassFilter,
+                                          attributeFilter)
+
+        def matches(self, qentry):
+                for filter in self._filters:
+                        if not filter.matches(qentry):
+                            return False
+                return True
+
+        def indices(self, cols, idx=None):
+                # most selective first so the others only see the survivors
+                filters = sorted(self._filters, key=lambda f: f.selectivity(cols))
+                for filter in filters:
+                        if idx is not None and len(idx) == 0:
+                                break
+                        idx = filter.indices(cols, idx)
+                return idx
+
+        def mask(self, cols, idx=None):
+                hits = self.indices(cols, idx)
+                if idx is None:
+                        m = np.zeros(len(cols), bool)
+                        m[hits] = True
+                        return m
+                return np.isin(idx, hits)
+
+        def key(self):
+                return ("All",) + tuple(filter.key() for filter in self._filters)
+
+        def refines(self, other):
+                if not isinstance(other, DefCompositeFilter):
+                        return DefFilter.refines(self, other)
+                for mine, theirs in zip(self._filters, other._filters):
+                        if not mine.refines(theirs):
+                                return False
+                return True
+
+        def replace(self, idx, filter):
+                newFilter = DefCompositeFilter(*self._filters)
+                newFilter._filters[idx] = filter
+                return newFilter
+
+        def getFilter(self, idx):
+                return self._filters[idx]
+
+class DefTimeFilter(DefFilter):
+
+        def __init__(self, dtLow, dtHigh):
+                self.dtL = dtLow
+                self.dtH = dtHigh
+
+        def matches(self, qentry):
+                dt = qentry._time
+                return self.dtL <= dt <= self.dtH
+
+        def mask(self, cols, idx=None):
+                t = cols.column("time", idx)
+                return (t >= toEpoch(self.dtL)) & (t <= toEpoch(self.dtH))
+
+        def indices(self, cols, idx=None):
+                if not cols.sorted:
+                        return DefFilter.indices(self, cols, idx)
+                lo, hi = cols.timeSlice(toEpoch(self.dtL), toEpoch(self.dtH))
+                if idx is None:
+                        return np.arange(lo, hi)
+                # idx is ascending, so the rows in [lo, hi) are a run of it
+                return idx[np.searchsorted(idx, lo):np.searchsorted(idx, hi)]
+
+        def selectivity(self, cols):
+                if not cols.sorted or len(cols) == 0:
+                        return DefFilter.selectivity(self, cols)
+                lo, hi = cols.timeSlice(toEpoch(self.dtL), toEpoch(self.dtH))
+                return float(hi - lo) / len(cols)
+
+        def key(self):
+                return ("Time", toEpoch(self.dtL), toEpoch(self.dtH))
+
+        def refines(self, other):
+                if isinstance(other, DefTimeFilter):
+                        return other.dtL <= self.dtL and self.dtH <= other.dtH
+                return DefFilter.refines(self, other)
+
+        def __str__(self):
+            s = str(self.dtL.year) + "-" + str(self.dtH.year)
+            return s
+
+class DefLocationFilter(DefFilter):
+
+        def __init__(self, strName, coords, prox):
+                self._name = strName
+                self._coords = coords
+                self._proximity = prox
+                self._center = QEntry.sphToEuc(coords.x, coords.y)
+                self._cosProximity = cos(radians(prox))
+
+        def matches(self, qentry):
+                # great circle distance, compared through the cosine
+                return qentry._p.dot(self._center) >= self._cosProximity
+
+        def mask(self, cols, idx=None):
+                return cols.capMask(self._coords.x, self._coords.y, self._proximity, idx)
+
+        def indices(self, cols, idx=None):
+                return cols.withinCap(self._coords.x, self._coords.y, self._proximity, idx)
+
+        def key(self):
+                return ("Location", self._coords.x, self._coords.y, self._proximity)
+
+        def refines(self, other):
+                if isinstance(other, DefLocationFilter):
+                        if self._center == other._center:
+                                return self._proximity <= other._proximity
+                        # cap inside cap, with some slack for rounding at the rim
+                        dot = max(-1.0, min(1.0, self._center.dot(other._center)))
+                        return degrees(acos(dot)) + self._proximity <= other._proximity - 1e-6
+                return DefFilter.refines(self, other)
+
+        def __str__(self):
+                s = self._name + \
+                    " (" + str(self._coords.x) + ", " + str(self._coords.y) + ")" + \
+                    " within " + str(self._proximity) + " degrees"
+                return s
+
+        def getCoords(self):
+                return self._coords
+
+
+
+# Locations
+filterJapan = DefLocationFilter("Japan", Vector2(35, 135), 20)
+filterIndonesia = DefLocationFilter("Indonesia", Vector2(0, 120), 25)
+filterLatinAmerica = DefLocationFilter("Mexico & Latin America", Vector2(20, -100), 25)
+filterChile = DefLocationFilter("Chile", Vector2(-33, -75), 20)
+filterWestPolynesia = DefLocationFilter("West Polynesia", Vector2(-19.235, -177.935), 30)
+
+
+
+class DefMagnitudeFilter(DefFilter):
+
+        def __init__(self, mLow, mHigh):
+                self.mL = mLow
+                self.mH = mHigh
+
+        def matches(self, qentry):
+                m = qentry._magnitude
+                return self.mL <= m <= self.mH
+
+        def mask(self, cols, idx=None):
+                m = cols.column("mag", idx)
+                return (m >= self.mL) & (m <= self.mH)
+
+        def key(self):
+                return ("Magnitude", self.mL, self.mH)
+
+        def refines(self, other):
+                if isinstance(other, DefMagnitudeFilter):
+                        return other.mL <= self.mL and self.mH <= other.mH
+                return DefFilter.refines(self, other)
+
+        def __str__(self):
+                s = str(self.mL) + "-" + str(self.mH)
+                return s
+
+
+class DefAttributeFilter(DefFilter):
+        # lists allow any of their values, the place must contain the text;
+        # unset criteria pass all
+
+        # column -> QEntry attribute
+        _ATTRS = (("net", "_net"),
+                  ("magType", "_magnitudeType"),
+                  ("type", "_type"))
+
+        def __init__(self, nets=None, magTypes=None, types=None, place=None):
+                self._values = {}
+                for name, values in zip(("net", "magType", "type"), (nets, magTypes, types)):
+                        if values is not None:
+                                self._values[name] = frozenset(values)
+                self._place = place
+
+        def matches(self, qentry):
+                for name, attr in DefAttributeFilter._ATTRS:
+                        if name in self._values and getattr(qentry, attr) not in self._values[name]:
+                                return False
+                return self._place is None or self._place in qentry._place
+
+        def mask(self, cols, idx=None):
+                m = np.ones(len(cols) if idx is None else len(idx), bool)
+                for name, values in self._values.items():
+                        m &= cols.valueMask(name, list(values), idx)
+                if self._place is not None:
+                        m &= cols.placeMask(self._place, idx)
+                return m
+
+        def indices(self, cols, idx=None):
+                for name, values in sorted(self._values.items()):
+                        idx = cols.valueRows(name, list(values), idx)
+                if self._place is not None:
+                        idx = cols.placeRows(self._place, idx)
+                if idx is None:
+                        return np.arange(len(cols))
+                return idx
+
+        def selectivity(self, cols):
+                if cols.categoryIndex is None or len(cols) == 0 or self._place is not None:
+                        return DefFilter.selectivity(self, cols)
+                # bitmap cardinalities, treating the columns as independent
+                fraction = 1.0
+                for name, values in self._values.items():
+                        fraction *= float(len(cols.categoryIndex.values(name, list(values)))) / len(cols)
+                return fraction
+
+        def key(self):
+                values = tuple((name, tuple(sorted(self._values[name])))
+                               for name in sorted(self._values))
+                return ("Attribute", values, self._place)
+
+        def refines(self, other):
+                if isinstance(other, DefAttributeFilter):
+                        for name, values in other._values.items():
+                                if name not in self._values or not self._values[name] <= values:
+                                        return False
+                        return other._place is None or \
+                               (self._place is not None and other._place in self._place)
+                return DefFilter.refines(self, other)
+
+        def __str__(self):
+                parts = []
+                for name in sorted(self._values):
+                        parts.append(name + " " + "/".join(sorted(self._values[name])))
+                if self._place is not None:
+                        parts.append("in " + self._place)
+                if len(parts) == 0:
+                        return "Any"
+                return ", ".join(parts)
+
+
+class DefClusterFilter(DefFilter):
+        # mainshocks only, or the events of one sequence; passes everything
+        # until the catalog is declustered
+
+        def __init__(self, mainshocksOnly=True, cluster=None):
+                self._mainshocksOnly = mainshocksOnly
+                self._cluster = cluster
+
+        def matches(self, qentry):
+                if not hasattr(qentry, "_cluster"):
+                        return True
+                if self._mainshocksOnly and not qentry._mainshock:
+                        return False
+                return self._cluster is None or qentry._cluster == self._cluster
+
+        def mask(self, cols, idx=None):
+                m = np.ones(len(cols) if idx is None else len(idx), bool)
+                if cols.cluster is None:
+                        return m
+                if self._mainshocksOnly:
+                        m &= cols.column("mainshock", idx)
+                if self._cluster is not None:
+                        m &= cols.column("cluster", idx) == self._cluster
+                return m
+
+        def key(self):
+                return ("Cluster", self._mainshocksOnly, self._cluster)
+
+        def refines(self, other):
+                if isinstance(other, DefClusterFilter):
+                        return (self._mainshocksOnly or not other._mainshocksOnly) and \
+                               (other._cluster is None or self._cluster == other._cluster)
+                return DefFilter.refines(self, other)
+
+        def __str__(self):
+                if self._cluster is not None:
+                        return "sequence " + str(self._cluster)
+                if self._mainshocksOnly:
+                        return "mainshocks"
+                return "Any"
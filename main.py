@@ -1,6 +1,8 @@
 import shapefile
 import csv
 import threading
+import time
+import numpy as np
 from shptogeom import ShapeToGeom
 
 from collections import deque
@@ -11,6 +13,9 @@ from cyclops import *
 from omegaToolkit import *
 
 from qtest import *
+from filters import *
+from bargeom import *
+from rebuild import *
 
 
 ################################################################################
@@ -104,6 +109,18 @@ class RangeSlider:
                 self._update = updateFunc
 
 
+        def setLimits(self, limits):
+                # e.g. once the catalog is loaded; keeps the range picked
+                # where it still fits
+                vL = self._sliderL.getValue() + self._limits[0]
+                vH = self._sliderH.getValue() + self._limits[0]
+                self._limits = limits
+                window = limits[1] - limits[0]
+                self._sliderL.setTicks(window + 1)
+                self._sliderH.setTicks(window + 1)
+                self._sliderL.setValue(min(max(vL, limits[0]), limits[1]) - limits[0])
+                self._sliderH.setValue(min(max(vH, limits[0]), limits[1]) - limits[0])
+
         def setPrevNextWidgets(self, prev, next):
                 self._sliderL.setVerticalPrevWidget(prev)
                 self._sliderH.setVerticalNextWidget(next)
@@ -125,147 +142,6 @@ class RangeSlider:
                 self._update(vL, vH)
 
 
-################################################################################
-# ########################## Filter Defs #######################################
-################################################################################
-
-class DefFilter:
-        @classmethod
-        def matches(cls, qentry):
-                pass
-
-        @classmethod
-        def __str__(cls):
-            return "Any"
-
-class DefPassFilter(DefFilter):
-
-        @classmethod
-        def matches(cls, qentry):
-                return True
-
-        @classmethod
-        def __str__(cls):
-            return "Any"
-
-class DefCompositeFilter(DefFilter):
-        LOCATION = 0
-        TIME = 1
-        MAGNITUDE = 2
-        _NUMENTRIES = 3
-
-        def __init__(self,
-                     locFilter=DefPassFilter(),
-                     timeFilter=DefPassFilter(),
-                     magFilter=DefPassFilter()):
-
-                    self._filters = [locFilter, timeFilter, magFilter]
-
-        @staticmethod
-        def QuickByTime(timeFilter):
-                return DefCompositeFilter(DefPassFilter,
-                                          timeFilter,
-                                          DefPassFilter)
-        @staticmethod
-        def QuickByLocation(locationFilter):
-                return DefCompositeFilter(locationFilter)
-
-        @staticmethod
-        def QuickByMagnitude(magnitudeFilter):
-                return DefCompositeFilter(DefPassFilter,
-                                          DefPassFilter,
-                                          magnitudeFilter)
-
-
-        def matches(self, qentry):
-                for filter in self._filters:
-                        if not filter.matches(qentry):
-                            return False
-                return True
-
-        def replace(self, idx, filter):
-                newFilter = DefCompositeFilter(self._filters[0],
-                                               self._filters[1],
-                                               self._filters[2])
-                newFilter._filters[idx] = filter
-                return newFilter
-
-        def getFilter(self, idx):
-                return self._filters[idx]
-
-class DefTimeFilter(DefFilter):
-
-        def __init__(self, dtLow, dtHigh):
-                self.dtL = dtLow
-                self.dtH = dtHigh
-
-        def matches(self, qentry):
-                dt = qentry._time
-                return self.dtL <= dt <= self.dtH
-
-        def __str__(self):
-            s = str(self.dtL.year) + "-" + str(self.dtH.year)
-            return s
-
-class DefLocationFilter(DefFilter):
-
-        def __init__(self, strName, coords, prox):
-                self._name = strName
-                self._coords = coords
-                self._proximity = prox
-
-        def matches(self, qentry):
-                dist = self._coords - qentry.Coords()
-                magnitude = dist.magnitude()
-                if (magnitude > 180):
-                        # could be the case of (170 | 10) (close but far)
-                        # need to shift so we can apply modulo arithmetic
-                        coords = self._coords + Vector2(180, 360)
-                        coords2 = qentry.Coords() + Vector2(180, 360)
-                        coords.x = coords.x % 180
-                        coords2.x = coords2.x % 180
-                        coords.y = coords.y % 360
-                        coords2.y = coords2.y % 360
-                        dist = coords - coords2
-                        magnitude = dist.magnitude()
-                print(self)
-                return magnitude <= self._proximity
-
-        def __str__(self):
-                s = self._name + \
-                    " (" + str(self._coords.x) + ", " + str(self._coords.y) + ")" + \
-                    " within " + str(self._proximity) + " degrees"
-                return s
-
-        def getCoords(self):
-                return self._coords
-
-
-
-# Locations
-filterJapan = DefLocationFilter("Japan", Vector2(35, 135), 20)
-filterIndonesia = DefLocationFilter("Indonesia", Vector2(0, 120), 25)
-filterLatinAmerica = DefLocationFilter("Mexico & Latin America", Vector2(20, -100), 25)
-filterChile = DefLocationFilter("Chile", Vector2(-33, -75), 20)
-filterWestPolynesia = DefLocationFilter("West Polynesia", Vector2(-19.235, -177.935), 30)
-
-
-
-class DefMagnitudeFilter(DefFilter):
-
-        def __init__(self, mLow, mHigh):
-                self.mL = mLow
-                self.mH = mHigh
-
-        def matches(self, qentry):
-                m = qentry._magnitude
-                return self.mL <= m <= self.mH
-
-        def __str__(self):
-                s = str(self.mL) + "-" + str(self.mH)
-                return s
-
-
 ################################################################################
 # ######################## Global Config Map ###################################
 ################################################################################
@@ -282,7 +158,8 @@ class GrandCfg:
         TIMEMAX = 8
         TIMEMIN = 9
         LOCATION = 10
-        _valCount = 11
+        COLORBYCLUSTER = 11
+        _valCount = 12
 
         # need reasonable defaults
         # some will get updated with actual values on startup
@@ -299,7 +176,8 @@ class GrandCfg:
                   6,
                   datetime.datetime(2014, 12, 31),
                   datetime.datetime(2010, 1, 1),
-                  Vector2(0, 0)]
+                  Vector2(0, 0),
+                  False]
         cbs = []
 
         @staticmethod
@@ -456,47 +334,134 @@ everything.addChild(light1)
 # ####################### Earthquake Representation ############################
 ################################################################################
 
+class BarsMesh(object):
+        # a mesh in the scene; cached ones stay there, hidden while not shown
+
+        def __init__(self, name, geom, obj, count):
+                self.name = name
+                self.geom = geom
+                self.obj = obj
+                self.count = count
+
+
 class Bars:
 
         _cH = Vector3(1, 0, 0)
         _cL = Vector3(0, 1, 0)
         _qdb = None
-        _models = []
-        _obj = None
+        _shown = None
         _parent = None
         _scale = 10
         _name = "Geom_Bars"
-        _lock = None
-        _lstGeom = None
-        _pollCount = 0
-
-        class GeomModel:
-                def __init__(self, geom):
-                        self.timestamp = datetime.datetime.now().time()
-                        self.geom = geom
-
-                @staticmethod
-                def Compare(x, y):
-                        if x.timestamp < y.timestamp:
-                                return - 1
-                        elif x.timestamp == y.timestamp:
-                                return 0
-                        else:
-                                return 1
+        # model names: of meshes being uploaded by generation, and free ones
+        _geomNames = {}
+        _freeNames = []
+        _nameCount = 0
+        # generation -> (cache key, bytes, vertices) of meshes cached once up
+        _meshKeys = {}
+        # BarsMesh objects in the cache, and values it dropped
+        _kept = set()
+        _evicted = deque()
+        # set by the worker when the settings need building again
+        _again = False
+        # while playback holds the bars, builds are put off until it lets go
+        _held = False
+        _owed = False
+        _fed = []
+        _fedShown = 0
+        _fedVocab = QColumns().vocab
+        _inst = None
+        _scheduler = None
+        _upload = None
+        _cache = None
+
+        # bars expanded per step on the worker, checking for cancellation
+        _CHUNK = 4096
+        # seconds of each frame spent copying bars into the scene
+        _BUDGET = 0.004
+        # bytes of built meshes kept around for reuse
+        _CACHE_BYTES = 256 * 1024 * 1024
+        # (zoom below, cell size in degrees): aggregate columns per cell
+        # instead of bars once zoomed out past the startup view (zoom 1),
+        # where bars shrink under a pixel; bars past the last threshold
+        _LOD = ((0.3, 8.0), (0.55, 4.0), (0.8, 2.0))
+        # cache key of the mesh on screen or being built
+        _shownKey = None
 
-        class DoBars(threading.Thread):
-                # lstQEntries, scale, boolShowByMag
-                def __init__(self, filter, scale, boolShowByMag):
-
-                        super(Bars.DoBars, self).__init__()
-                        self.filter = filter
-                        self.scale = scale
-                        self.showByMag = boolShowByMag
+        @staticmethod
+        def _rebuild(ticket, filter, scale, boolShowByMag, catalog):
+                # runs on the scheduler's worker thread; catalog is the QDB
+                # generation read when the build was asked for, never newer
+                # than the rows it queries
+                if Bars._declusterFirst(filter, None):
+                        return
+                last = Bars._inst
+                key = Bars._cacheKey(filter, scale, boolShowByMag, None, catalog)
+                # what the instances depend on besides the filter
+                instKey = (key[3], key[4], catalog)
+                if last is not None and last[0] is filter and last[2] == instKey:
+                        # same filter, colors and catalog: only scale or
+                        # show-by-magnitude changed
+                        inst = last[1].withQuantity(boolShowByMag)
+                else:
+                        query = Bars._qdb.queryByFilter(filter)
+                        ticket.check()
+                        inst = Bars._instances(query, boolShowByMag)
+
+                Bars._inst = (filter, inst, instKey)
+                ticket.check()
+                Bars._buildInstances(inst, scale, ticket, key)
 
-                def run(self):
+        @staticmethod
+        def _rebuildCells(ticket, filter, scale, boolShowByMag, level, catalog):
+                # runs on the scheduler's worker thread: aggregates the
+                # filter result for every level at once, so zooming out
+                # afterwards only picks a cached mesh. Only when the catalog
+                # is still the one asked for; after a refresh just the level
+                # shown is built and not kept
+                if Bars._declusterFirst(filter, level):
+                        return
+                cols, current = Bars._qdb.snapshot()
+                idx = Bars._qdb.queryByFilter(filter, cols).Indices()
+                cH = Bars._cH
+                cL = Bars._cL
+                for zoom, cellDeg in Bars._LOD:
+                        if current != catalog and cellDeg != level:
+                                continue
+                        ticket.check()
+                        stats = QCellGrid(cellDeg).aggregate(cols, idx)
+                        inst = cellInstances(stats, boolShowByMag,
+                                             GrandCfg.get(GrandCfg.MAGMIN),
+                                             GrandCfg.get(GrandCfg.MAGMAX),
+                                             (cH.x, cH.y, cH.z), (cL.x, cL.y, cL.z))
+                        verts, colors = Bars._expand(inst, scale, ticket)
+                        key = None
+                        if current == catalog:
+                                key = Bars._cacheKey(filter, scale, boolShowByMag, cellDeg, catalog)
+                        if cellDeg == level:
+                                Bars._offer(ticket.generation, verts, colors, key)
+                        elif key is not None:
+                                # kept as arrays until zoomed to
+                                Bars._cache.put(key, (verts, colors), verts.nbytes + colors.nbytes)
 
-                        query = Bars._qdb.queryByFilter(self.filter)
-                        Bars._build(query, self.scale, self.showByMag)
+        @staticmethod
+        def _declusterFirst(filter, level):
+                # sequences are only worked out once something shows them,
+                # the colors or the mainshock filter, and then here on the
+                # worker. The catalog changes with them, so the build starts
+                # over; True when it did
+                if Bars._qdb.declustered():
+                        return False
+                byCluster = level is None and GrandCfg.get(GrandCfg.COLORBYCLUSTER)
+                getFilter = getattr(filter, "getFilter", None)
+                byFilter = getFilter is not None and \
+                           isinstance(getFilter(DefCompositeFilter.CLUSTER), DefClusterFilter)
+                if not byCluster and not byFilter:
+                        return False
+                Bars._qdb.decluster()
+                Bars._shownKey = None
+                Bars._again = True
+                return True
 
         @staticmethod
         def init(Qdb, parent):
@@ -505,77 +470,146 @@ class Bars:
                 GrandCfg.addCallback(GrandCfg.SCALE, Bars)
                 GrandCfg.addCallback(GrandCfg.FILTER, Bars)
                 GrandCfg.addCallback(GrandCfg.SHOWBYMAG, Bars)
+                GrandCfg.addCallback(GrandCfg.COLORBYCLUSTER, Bars)
+                GrandCfg.addCallback(GrandCfg.ZOOM, Bars)
 
-                Bars._lock = threading.Lock()
-                Bars._lstGeom = []
-                Bars._pollCount = 0
-
-                if Bars._obj is None:
-                        Bars.update(1)
+                Bars._scheduler = RebuildScheduler(name="Bars")
+                Bars._upload = UploadStage(Bars._beginGeom, Bars._uploadGeom, Bars._swapGeom,
+                                           Bars._BUDGET, 256 * BAR_VERTICES,
+                                           rewrite=Bars._rewriteGeom, unit=BAR_VERTICES)
+                Bars._cache = GeomCache(Bars._CACHE_BYTES, onEvict=Bars._evicted.append)
 
         @staticmethod
-        def addGeomCandidate(geomModel):
-                # block
-                Bars._lock.acquire(True)
-                Bars._lstGeom.append(geomModel)
-                Bars._lock.release()
+        def reload():
+                # the catalog finished loading or changed: nothing built
+                # from it before holds, so build afresh for the settings
+                Bars._cache.clear()
+                Bars._inst = None
+                Bars._shownKey = None
+                Bars._fed = []
+                Bars._fedShown = 0
+                Bars.update(1)
 
         @staticmethod
-        def _markCached(tuple):
-                found = False
-                for idx, model in enumerate(Bars._models):
-                        if model[0] == tuple[0]:
-                                # model located, update scale
-                                Bars._models[idx] = tuple
-                                found = True
-                                break
-                if not found:
-                        Bars._models.append(tuple)
+        def _cacheKey(filter, scale, boolShowByMag, level, catalog):
+                # level is the cell size shown, None for bars; catalog is the
+                # QDB generation built from. Colors follow the magnitude range
+                byCluster = level is None and GrandCfg.get(GrandCfg.COLORBYCLUSTER)
+                mags = (GrandCfg.get(GrandCfg.MAGMIN), GrandCfg.get(GrandCfg.MAGMAX))
+                return (filter.key(), scale, boolShowByMag, byCluster, mags, level, catalog)
 
         @staticmethod
-        def _hasModel(tuple):
-                for model in Bars._models:
-                        if model[0] == tuple[0] and model[1] == tuple[1]:
-                                return True
-                return False
+        def _level():
+                zoom = GrandCfg.get(GrandCfg.ZOOM)
+                for below, cellDeg in Bars._LOD:
+                        if zoom < below:
+                                return cellDeg
+                return None
 
         @staticmethod
         def pollInstantiate():
+                # called every frame; uploads within the frame budget and
+                # swaps the bars in as soon as a mesh is complete
+                while len(Bars._evicted) > 0:
+                        value = Bars._evicted.popleft()
+                        if isinstance(value, BarsMesh):
+                                Bars._kept.discard(value)
+                                if value is not Bars._shown:
+                                        Bars._dropMesh(value)
+                if Bars._owed and not Bars._held:
+                        Bars._owed = False
+                        Bars._again = True
+                if Bars._again:
+                        Bars._again = False
+                        Bars.update(1)
+                Bars._upload.step()
 
-                Bars._pollCount += 1
+        @staticmethod
+        def hold():
+                # playback is putting up its own meshes: settings and catalog
+                # changes meanwhile are built once release() is called
+                Bars._held = True
 
-                if Bars._pollCount < 100:
-                        return
+        @staticmethod
+        def release():
+                # from any thread; the next frame builds what was put off
+                Bars._held = False
 
-                if len(Bars._lstGeom) == 0:
-                        return
+        @staticmethod
+        def uploadTimings():
+                # (last, mean, max) seconds per frame
+                return Bars._upload.timings()
 
-                if not Bars._lock.acquire(False):
-                        return
+        @staticmethod
+        def _beginGeom(generation):
+                if len(Bars._freeNames) > 0:
+                        name = Bars._freeNames.pop()
+                else:
+                        Bars._nameCount += 1
+                        name = Bars._name + str(Bars._nameCount)
+                Bars._geomNames[generation] = name
+                return ModelGeometry.create(name)
+
+        @staticmethod
+        def _uploadGeom(geom, verts, colors, first):
+                for v, c in zip(verts.tolist(), colors.tolist()):
+                        geom.addVertex(Vector3(v[0], v[1], v[2]))
+                        geom.addColor(Color(c[0], c[1], c[2], c[3]))
 
-                Bars._pollCount = 0
-                Bars._lstGeom.sort(cmp=Bars.GeomModel.Compare, reverse=True)
+                for vstart in range(first, first + len(verts), BAR_VERTICES):
+                        geom.addPrimitive(PrimitiveType.TriangleStrip, vstart, BAR_VERTICES)
 
-                geomModel = Bars._lstGeom.pop()
-                Bars._lstGeom = []
+        @staticmethod
+        def _rewriteGeom(geom, verts, colors, first):
+                for i, (v, c) in enumerate(zip(verts.tolist(), colors.tolist())):
+                        geom.setVertex(first + i, Vector3(v[0], v[1], v[2]))
+                        geom.setColor(first + i, Color(c[0], c[1], c[2], c[3]))
 
-                if Bars._obj is not None:
-                        parent = Bars._obj.getParent()
-                        parent.removeChildByRef(Bars._obj)
-                        Bars._obj = None
+        @staticmethod
+        def _swapGeom(geom, generation):
+                name = Bars._geomNames.pop(generation)
+                entry = Bars._meshKeys.pop(generation, None)
+                # older meshes were superseded, their targets abandoned
+                for g in list(Bars._geomNames):
+                        if g < generation:
+                                Bars._freeNames.append(Bars._geomNames.pop(g))
+                for g in list(Bars._meshKeys):
+                        if g < generation:
+                                Bars._meshKeys.pop(g, None)
+
+                sceneMgr.addModel(geom)
+                obj = StaticObject.create(name)
+                obj.setSelectable(False)
+                obj.setCullingActive(True)
+                obj.getMaterial().setProgram("colored byvertex")
+                Bars._parent.addChild(obj)
+
+                mesh = BarsMesh(name, geom, obj, 0)
+                Bars._showMesh(mesh)
+                if entry is not None:
+                        key, nbytes, mesh.count = entry
+                        Bars._kept.add(mesh)
+                        Bars._cache.put(key, mesh, nbytes)
 
-                sceneMgr.addModel(geomModel.geom)
-                Bars._obj = StaticObject.create(Bars._name)
-                Bars._obj.setSelectable(False)
-                Bars._obj.setCullingActive(True)
-                Bars._obj.getMaterial().setProgram("colored byvertex")
-                Bars._parent.addChild(Bars._obj)
+        @staticmethod
+        def _showMesh(mesh):
+                old = Bars._shown
+                Bars._shown = mesh
+                mesh.obj.setVisible(True)
+                if old is not None and old is not mesh:
+                        if old in Bars._kept:
+                                old.obj.setVisible(False)
+                        else:
+                                Bars._dropMesh(old)
 
-                Bars._lock.release()
+        @staticmethod
+        def _dropMesh(mesh):
+                Bars._parent.removeChildByRef(mesh.obj)
+                Bars._freeNames.append(mesh.name)
 
 
         @staticmethod
-        def update(value):
+        def _settings():
                 scale = GrandCfg.get(GrandCfg.SCALE)
                 filter = GrandCfg.get(GrandCfg.FILTER)
                 showByMag = GrandCfg.get(GrandCfg.SHOWBYMAG)
@@ -588,121 +622,258 @@ class Bars:
                         maxmag = GrandCfg.get(GrandCfg.MAGMAX)
                         scale = float(scale) / maxmag * 0.1
 
-                #Bars._build(filter, scale, showByMag)
-                t = Bars.DoBars(filter, scale, showByMag)
-                t.start()
-                print("***** Returned ****")
+                return filter, scale, showByMag
 
         @staticmethod
-        def _prep(filter, scale, boolShowByMag):
+        def update(value):
+                if Bars._held:
+                        Bars._owed = True
+                        return
+                filter, scale, showByMag = Bars._settings()
+                level = Bars._level()
+                catalog = Bars._qdb.generation
+                key = Bars._cacheKey(filter, scale, showByMag, level, catalog)
+                if key == Bars._shownKey:
+                        # e.g. zooming within one level
+                        return
+                Bars._shownKey = key
+                Bars._fed = []
+                Bars._fedShown = 0
+
+                cached = Bars._cache.get(key)
+                if cached is not None:
+                        # superseding whatever the worker is doing
+                        generation = Bars._scheduler.nextGeneration()
+                        if isinstance(cached, BarsMesh):
+                                # still in the scene, hidden: show it
+                                Bars._upload.adopt(generation, cached.geom, cached.count)
+                                Bars._showMesh(cached)
+                        else:
+                                Bars._offer(generation, cached[0], cached[1], key)
+                        return
 
-                query = Bars._qdb.queryByFilter(filter)
-                Bars._build(query, scale, boolShowByMag)
+                # a request arriving while the worker is busy replaces the
+                # waiting one and cancels the running build
+                if level is None:
+                        Bars._scheduler.submit(Bars._rebuild, filter, scale, showByMag, catalog)
+                else:
+                        Bars._scheduler.submit(Bars._rebuildCells, filter, scale, showByMag, level, catalog)
 
+        @staticmethod
+        def feed(chunk):
+                # preview while the catalog is still loading: keep the rows of
+                # each chunk that pass the filter; the worker appends bars for
+                # those not shown yet to the preview mesh
+                if Bars._held:
+                        # reload() builds them all once loaded
+                        return
+                filter, scale, showByMag = Bars._settings()
+                Bars._shownKey = None
+                # chunks of different catalogs have their own vocabularies
+                chunk = chunk.take(filter.indices(chunk))
+                Bars._fed.append(chunk.withVocab(Bars._fedVocab))
+                Bars._scheduler.submit(Bars._feedRows, Bars._fed, scale, showByMag)
+
+        @staticmethod
+        def _feedRows(ticket, fed, scale, boolShowByMag):
+                # runs on the scheduler's worker thread. A job replaced while
+                # waiting leaves its chunks to the next one
+                shown = Bars._fedShown
+                count = len(fed)
+                if fed is not Bars._fed or shown >= count:
+                        return
+                rows = QColumns.Concat(fed[shown:count])
+                inst = Bars._instances(QEntryView(rows), boolShowByMag)
+                verts, colors = Bars._expand(inst, scale, ticket)
+                ticket.check()
+                if shown == 0:
+                        Bars._upload.offer(ticket.generation, verts, colors)
+                elif not Bars._upload.extend(ticket.generation, verts, colors):
+                        return
+                Bars._fedShown = count
 
+        @staticmethod
+        def _instances(lstQEntries, boolShowByMag):
+                cH = Bars._cH
+                cL = Bars._cL
+                cols = lstQEntries.Columns()
+                colors = None
+                if GrandCfg.get(GrandCfg.COLORBYCLUSTER) and cols.cluster is not None:
+                        colors = clusterColors(cols.cluster, cols.mainshock)
+                return BarInstances(cols, boolShowByMag,
+                                    GrandCfg.get(GrandCfg.MAGMIN),
+                                    GrandCfg.get(GrandCfg.MAGMAX),
+                                    (cH.x, cH.y, cH.z), (cL.x, cL.y, cL.z),
+                                    colors=colors)
 
         @staticmethod
         def _build(lstQEntries, scale, boolShowByMag):
+                Bars._shownKey = None
+                Bars._buildInstances(Bars._instances(lstQEntries, boolShowByMag), scale)
+
+        @staticmethod
+        def _buildInstances(inst, scale, ticket=None, key=None):
+
+                if ticket is not None:
+                        generation = ticket.generation
+                else:
+                        # built outside the scheduler, still newer than anything queued
+                        generation = Bars._scheduler.nextGeneration()
+
+                verts, colors = Bars._expand(inst, scale, ticket)
+                if ticket is not None:
+                        ticket.check()
+                Bars._offer(generation, verts, colors, key)
+                return verts, colors
+
+        @staticmethod
+        def _offer(generation, verts, colors, key=None):
+                # key, when given, is what the mesh is cached under once it
+                # is in the scene
+                if key is not None:
+                        Bars._meshKeys[generation] = (key, verts.nbytes + colors.nbytes, len(verts))
+                Bars._upload.offer(generation, verts, colors)
+
+        @staticmethod
+        def _expand(inst, scale, ticket=None):
+                # omega has no instanced draw, expand on the cpu
+                verts = []
+                colors = []
+                for start in range(0, max(1, len(inst)), Bars._CHUNK):
+                        if ticket is not None:
+                                ticket.check()
+                        v, c = inst.expand(scale, start, start + Bars._CHUNK)
+                        verts.append(v)
+                        colors.append(c)
+
+                return np.concatenate(verts), np.concatenate(colors)
+
+        @staticmethod
+        def showRing(ring):
+                # put up the whole mesh of a BarRing; returns the generation
+                # its patches are written to
+                Bars._shownKey = None
+                generation = Bars._scheduler.nextGeneration()
+                verts, colors = ring.mesh()
+                Bars._upload.offer(generation, verts, colors)
+                return generation
+
+        @staticmethod
+        def patchRing(generation, patches):
+                for first, verts, colors in patches:
+                        Bars._upload.patch(generation, first, verts, colors)
+
+        @staticmethod
+        def append(rows, replaced):
+                # after a catalog refresh: add bars for just the new events,
+                # unless an event on screen may have changed, the bars on
+                # screen are not those of the settings (e.g. the magnitude
+                # range and so the colors moved) or other work is in flight,
+                # then rebuild
+                shown = Bars._shownKey
+                Bars._cache.clear()
+                Bars._inst = None
+                Bars._shownKey = None
+                filter, scale, showByMag = Bars._settings()
+                current = shown is not None and \
+                          shown[:-1] == Bars._cacheKey(filter, scale, showByMag, None, None)[:-1]
+                if Bars._held or replaced.any() or not current or \
+                   not Bars._scheduler.idle() or Bars._upload.busy():
+                        Bars.update(1)
+                        return
+
+                Bars._scheduler.submit(Bars._extend, filter, scale, showByMag, rows)
 
-                # if Bars._obj is not None:
-                #         parent = Bars._obj.getParent()
-                #         parent.removeChildByRef(Bars._obj)
-                #         Bars._obj = None
-
-                geom = ModelGeometry.create(Bars._name)
-                geomModel = Bars.GeomModel(geom)
-
-                thickness = 0.005
-
-                t = thickness
-                n = Vector3(0, 1, 0)
-                mShift = GrandCfg.get(GrandCfg.MAGMIN)
-                mRatio = 1.0 / (GrandCfg.get(GrandCfg.MAGMAX) - mShift)
-
-                count = 0
-                vcount = 0
-
-                for entry in lstQEntries:
-
-                        count += 1
-
-                        p = entry._p.normalized()
-                        axis = n.cross(p)
-                        angle = acos(p.dot(n))
-
-                        quantity = entry._depth
-                        if boolShowByMag:
-                            quantity = entry._magnitude
-
-                        # prepare transformation matrix
-                        m = Matrix4()
-                        m.translate(p.x, p.y, p.z)
-                        m.rotate_axis(angle, axis)
-                        m.scale(1, quantity * scale, 1)
-
-                        v0 = m.transform(Vector3(-t, 0, t))
-                        v1 = m.transform(Vector3(-t, 1, t))
-                        v2 = m.transform(Vector3(t, 0, t))
-                        v3 = m.transform(Vector3(t, 1, t))
-                        v4 = m.transform(Vector3(t, 0, -t))
-                        v5 = m.transform(Vector3(t, 1, -t))
-                        v6 = m.transform(Vector3(-t, 0, -t))
-                        v7 = m.transform(Vector3(-t, 1, -t))
-                        v8 = m.transform(Vector3(-t, 0, t))
-                        v9 = m.transform(Vector3(-t, 1, t))
-
-                        color = colorLerp(Bars._cH, Bars._cL, (entry._magnitude - mShift) * mRatio)
-
-                        geom.addVertex(v0)
-                        geom.addColor(color)
-                        geom.addVertex(v1)
-                        geom.addColor(color)
-                        geom.addVertex(v6)
-                        geom.addColor(color)
-                        geom.addVertex(v7)
-                        geom.addColor(color)
-                        geom.addVertex(v4)
-                        geom.addColor(color)
-                        geom.addVertex(v5)
-                        geom.addColor(color)
-                        geom.addVertex(v2)
-                        geom.addColor(color)
-                        geom.addVertex(v3)
-                        geom.addColor(color)
-                        geom.addVertex(v0)
-                        geom.addColor(color)
-                        geom.addVertex(v1)
-                        geom.addColor(color)
-                        geom.addVertex(v7)
-                        geom.addColor(color)
-                        geom.addVertex(v5)
-                        geom.addColor(color)
-                        geom.addVertex(v3)
-                        geom.addColor(color)
-                        geom.addVertex(v1)
-                        geom.addColor(color)
-
-                        geom.addPrimitive(PrimitiveType.TriangleStrip, vcount, 14)
-                        vcount += 14
-
-
-
-                Bars.addGeomCandidate(geomModel)
+        @staticmethod
+        def _extend(ticket, filter, scale, boolShowByMag, rows):
+                # runs on the scheduler's worker thread
+                rows = rows.take(filter.indices(rows))
+                if len(rows) == 0:
+                        return
+                inst = Bars._instances(QEntryView(rows), boolShowByMag)
+                verts, colors = Bars._expand(inst, scale, ticket)
+                ticket.check()
+                if not Bars._upload.extend(ticket.generation, verts, colors):
+                        Bars._shownKey = None
+                        Bars._again = True
 
 
 
 ################################################################################
 
-qdb = QDB("data/query1950.csv")
-qdb.Parse()
-GrandCfg.set(GrandCfg.TIMEMAX, qdb.timeHigh)
-GrandCfg.set(GrandCfg.TIMEMIN, qdb.timeLow)
-GrandCfg.set(GrandCfg.DEPTHMAX, qdb.depthHigh)
-GrandCfg.set(GrandCfg.DEPTHMIN, qdb.timeLow)
-GrandCfg.set(GrandCfg.MAGMAX, qdb.magHigh)
-GrandCfg.set(GrandCfg.MAGMIN, qdb.magLow)
+def setCatalogLimits(qdb):
+        GrandCfg.set(GrandCfg.TIMEMAX, qdb.timeHigh)
+        GrandCfg.set(GrandCfg.TIMEMIN, qdb.timeLow)
+        GrandCfg.set(GrandCfg.DEPTHMAX, qdb.depthHigh)
+        GrandCfg.set(GrandCfg.DEPTHMIN, qdb.timeLow)
+        GrandCfg.set(GrandCfg.MAGMAX, qdb.magHigh)
+        GrandCfg.set(GrandCfg.MAGMIN, qdb.magLow)
+
+qdb = QDB(["data/query1950.csv",
+           "data/query2000.csv",
+           "data/query2010.csv"])
 Bars.init(qdb, earth)
 
+# parse on a background thread; the frame loop previews the chunks as they
+# are read and builds the whole catalog once it is in
+loadedChunks = deque()
+
+class CatalogLoader(threading.Thread):
+        def run(self):
+                qdb.Parse(onChunk=loadedChunks.append)
+
+loader = CatalogLoader()
+loader.daemon = True
+loader.start()
+
+
+# the catalogs are rewritten by the feed every few minutes; refresh on a
+# background thread and hand the new rows to the frame loop
+REFRESH_SECONDS = 300
+refreshedRows = deque()
+qdb.addListener(lambda rows, replaced: refreshedRows.append((rows, replaced)))
+
+class CatalogRefresher(threading.Thread):
+        def run(self):
+                while True:
+                        time.sleep(REFRESH_SECONDS)
+                        try:
+                                qdb.refresh()
+                        except Exception as e:
+                                # e.g. a catalog caught mid write: keep the
+                                # thread and try again next time
+                                print("refresh failed: " + repr(e))
+
+refresher = CatalogRefresher()
+refresher.daemon = True
+
+def pollLoad():
+        global loader
+        if loader is None:
+                return
+        done = not loader.is_alive()
+        while len(loadedChunks) > 0:
+                chunk = loadedChunks.popleft()
+                if not done:
+                        # stats grow with every chunk read
+                        setCatalogLimits(qdb)
+                        Bars.feed(chunk)
+        if not done:
+                return
+
+        loader = None
+        setCatalogLimits(qdb)
+        rsTime.setLimits(getTimeLimits())
+        rsMag.setLimits(getMagLimits())
+        Bars.reload()
+        refresher.start()
+
+def pollRefresh():
+        while len(refreshedRows) > 0:
+                rows, replaced = refreshedRows.popleft()
+                setCatalogLimits(qdb)
+                Bars.append(rows, replaced)
+
 
 ################################################################################
 # ############################       UI      ###################################
@@ -803,6 +974,22 @@ ckbtnShowByMag.setChecked(GrandCfg.get(GrandCfg.SHOWBYMAG))
 def onCkBtnShowByMagEvent():
         GrandCfg.set(GrandCfg.SHOWBYMAG, ckbtnShowByMag.isChecked())
 
+ckbtnColorByCluster = wf.createCheckButton("Color By Sequence", adjmc)
+ckbtnColorByCluster.setUIEventCommand("onCkBtnColorByClusterEvent()")
+ckbtnColorByCluster.setChecked(GrandCfg.get(GrandCfg.COLORBYCLUSTER))
+def onCkBtnColorByClusterEvent():
+        GrandCfg.set(GrandCfg.COLORBYCLUSTER, ckbtnColorByCluster.isChecked())
+
+ckbtnMainshocks = wf.createCheckButton("Mainshocks Only", adjmc)
+ckbtnMainshocks.setUIEventCommand("onCkBtnMainshocksEvent()")
+ckbtnMainshocks.setChecked(False)
+def onCkBtnMainshocksEvent():
+        clusterFilter = DefPassFilter()
+        if ckbtnMainshocks.isChecked():
+                clusterFilter = DefClusterFilter()
+        oldf = GrandCfg.get(GrandCfg.FILTER)
+        GrandCfg.set(GrandCfg.FILTER, oldf.replace(DefCompositeFilter.CLUSTER, clusterFilter))
+
 
 rsTime.setPrevNextWidgets(sliderScale, rsMag.getSliderLow())
 rsMag.setPrevNextWidgets(rsTime.getSliderHigh(), ckbtnShowByMag)
@@ -870,41 +1057,113 @@ def reset():
         GrandCfg.set(GrandCfg.ZOOM, 1)
 
 class DoHistory(threading.Thread):
+        # seconds between playback steps
+        TICK = 0.05
+
+        def __init__(self, unit="day", speed=1.0, window=None):
+                threading.Thread.__init__(self)
+                self.daemon = True
+                self.playback = QPlayback(qdb.buckets(unit), speed)
+                # with a window (in buckets) the bars of the last window
+                # buckets stay up, fading with age
+                self.window = window
+                self._halt = threading.Event()
+                self._lock = threading.Lock()
+
+        def setSpeed(self, speed):
+                # buckets per second, negative plays backwards
+                with self._lock:
+                        self.playback.speed = speed
+
+        def seek(self, dt):
+                with self._lock:
+                        self.playback.seek(dt)
+                        self._shown = None
+
+        def stop(self):
+                self._halt.set()
+
         def run(self):
-                qdb.initPlayback()
+                try:
+                        self._play()
+                finally:
+                        Bars.release()
+
+        def _play(self):
                 scale = GrandCfg.get(GrandCfg.SCALE)
                 showByMag = GrandCfg.get((GrandCfg.SHOWBYMAG))
+                buckets = self.playback.buckets
+                self._shown = None
+
+                ring = None
+                if self.window is not None:
+                        ring = BarRing(max(1, buckets.maxCount(self.window)), self.window)
+                        generation = Bars.showRing(ring)
+
+                while not self._halt.is_set():
+                        with self._lock:
+                                if self.playback.done():
+                                        break
+                                k = self.playback.current()
+                                last = self._shown
+                                show = k != last
+                                self._shown = k
+
+                        if show:
+                                print(str(buckets.start(k).date()) + ": " + str(buckets.count[k]))
+                                # camera to the strongest cluster of the bucket
+                                center = qdb.hotspot(qdb.bucketEntries(buckets, k), True)
+                                if center is not None:
+                                        earthGoTo(center[0], center[1])
+                                if ring is None:
+                                        Bars._build(qdb.bucketEntries(buckets, k), scale, showByMag)
+                                else:
+                                        self._slide(ring, generation, last, k, scale, showByMag)
+
+                        self._halt.wait(DoHistory.TICK)
+                        with self._lock:
+                                self.playback.step(DoHistory.TICK)
+
+        def _slide(self, ring, generation, last, k, scale, showByMag):
+                # forward by less than a window only adds the buckets entered;
+                # anything else starts the window over
+                buckets = self.playback.buckets
+                patches = []
+                if last is not None and last < k < last + self.window:
+                        lo = last + 1
+                else:
+                        patches.extend(ring.clear())
+                        lo = max(0, k - self.window + 1)
+
+                entries = qdb.bucketEntries(buckets, lo, k + 1)
+                if len(entries) > 0:
+                        times = np.repeat(np.arange(lo, k + 1), buckets.count[lo:k + 1])
+                        inst = Bars._instances(entries, showByMag)
+                        patches.extend(ring.push(inst, times, scale, k))
+                patches.extend(ring.advance(k))
+                Bars.patchRing(generation, patches)
+
+history = None
+
+def doHistoryTrampoline(unit="day", speed=1.0, window=None):
+
+        global history
+        if history is not None:
+                # one playback patching the bars at a time
+                history.stop()
+                history.join()
+        history = DoHistory(unit, speed, window)
+        Bars.hold()
+        history.start()
+        print("Returned")
 
-                lstQEntries = qdb.getNextDay()
-                print(len(lstQEntries))
-                while len(lstQEntries) > 0:
-
-                        avgPos = Vector2(0, 0)
-                        count = 0
-                        for qentry in lstQEntries:
-                                avgPos += Vector2(qentry._latitude, qentry._longitude)
-                                count += 1
-
-                        avgPos /= count
-
-                        earthGoTo(avgPos.x, avgPos.y)
-
-                        Bars._build(lstQEntries, scale, showByMag)
-
-                        t = threading.currentThread()
-                        cv = threading.Condition()
-                        cv.acquire()
-                        cv.wait(1.0)
-                        cv.release()
-
-                        lstQEntries = qdb.getNextDay()
-                        print(len(lstQEntries))
-
-def doHistoryTrampoline():
+def historySpeed(speed):
+        if history is not None:
+                history.setSpeed(speed)
 
-        t = DoHistory()
-        t.start()
-        print("Returned")
+def historySeek(year, month=1, day=1):
+        if history is not None:
+                history.seek(datetime.datetime(year, month, day))
 
 
 
@@ -1171,6 +1430,8 @@ setEventFunction(handleEvent)
 def onUpdate(frame, t, dt):
 
         uctrl.Update(dt)
+        pollLoad()
+        pollRefresh()
         Bars.pollInstantiate()
 
 
@@ -1,14 +1,32 @@
+import os
+import re
 import csv
+import copy
+import json
 import math
+import shutil
 import datetime
+import itertools
+import threading
+import numpy as np
 from euclid import *
 
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EARTH_RADIUS = 6371
+
 ################################################################################
 
+def toEpoch(dt):
+        # dt is naive UTC
+        delta = dt - _EPOCH
+        return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+def fromEpoch(secs):
+        return _EPOCH + datetime.timedelta(seconds=int(secs))
 
 ################################################################################
 
-class QEntry:
+class QEntry(object):
 
         def __init__(self, t, lat, lon, depth, mag, magType, nst, gap, dmin, rms, net, ID, updated, place, type):
                 self._time = QEntry.toTime(t)
@@ -53,10 +71,1136 @@ class QEntry:
                 point = Vector3(x, y, z)
                 return point.normalized()
 
+        @staticmethod
+        def FromColumns(cols, i):
+                qe = QEntry.__new__(QEntry)
+                qe._time = fromEpoch(cols.time[i])
+                qe._latitude = float(cols.lat[i])
+                qe._longitude = float(cols.lon[i])
+                qe._p = Vector3(float(cols.x[i]), float(cols.y[i]), float(cols.z[i]))
+                qe._depth = float(cols.depth[i])
+                qe._magnitude = float(cols.mag[i])
+                qe._magnitudeType = cols.decode("magType", i)
+                qe._nst = QColumns.optional(cols.nst[i])
+                qe._gap = QColumns.optional(cols.gap[i])
+                qe._dmin = QColumns.optional(cols.dmin[i])
+                qe._rms = QColumns.optional(cols.rms[i])
+                qe._net = cols.decode("net", i)
+                qe._id = cols.id[i]
+                qe._updated = fromEpoch(cols.updated[i])
+                qe._place = cols.place[i]
+                qe._type = cols.decode("type", i)
+                if cols.cluster is not None:
+                        qe._cluster = int(cols.cluster[i])
+                        qe._mainshock = bool(cols.mainshock[i])
+                return qe
+
+################################################################################
+
+class QColumns(object):
+        # one earthquake per row: times are epoch seconds, depth is normalized
+        # to the earth radius, net/magType/type index into vocab. cluster and
+        # mainshock are set by decluster() and not cached
+
+        NUMERIC = (("time", np.int64),
+                   ("lat", np.float64),
+                   ("lon", np.float64),
+                   ("depth", np.float64),
+                   ("mag", np.float64),
+                   ("x", np.float64),
+                   ("y", np.float64),
+                   ("z", np.float64),
+                   ("updated", np.int64),
+                   ("nst", np.float64),
+                   ("gap", np.float64),
+                   ("dmin", np.float64),
+                   ("rms", np.float64))
+        CODED = ("net", "magType", "type")
+        TEXT = ("id", "place")
+
+        def __init__(self, vocab=None):
+                for name, dtype in QColumns.NUMERIC:
+                        setattr(self, name, np.zeros(0, dtype))
+                for name in QColumns.CODED:
+                        setattr(self, name, np.zeros(0, np.int16))
+                for name in QColumns.TEXT:
+                        setattr(self, name, np.zeros(0, "S1"))
+                if vocab is None:
+                        vocab = dict((name, []) for name in QColumns.CODED)
+                self.vocab = vocab
+                self.sorted = False
+                # no two rows share an id
+                self.unique = False
+                self.sphereIndex = None
+                self.categoryIndex = None
+                self.cluster = None
+                self.mainshock = None
+
+        def __len__(self):
+                return len(self.time)
+
+        @staticmethod
+        def names():
+                return [n for n, t in QColumns.NUMERIC] + list(QColumns.CODED) + list(QColumns.TEXT)
+
+        @staticmethod
+        def FromRows(rows, vocab=None):
+                # rows are raw csv rows in QDB column order; short rows and rows
+                # that do not parse, e.g. one cut off mid write, are skipped
+                rows = [row for row in rows if len(row) > QDB.type]
+                try:
+                        return QColumns._fromRows(rows, vocab)
+                except ValueError:
+                        rows = [row for row in rows if QColumns._parses(row)]
+                        return QColumns._fromRows(rows, vocab)
+
+        @staticmethod
+        def _parses(row):
+                try:
+                        QColumns._fromRows([row])
+                except ValueError:
+                        return False
+                return True
+
+        @staticmethod
+        def _fromRows(rows, vocab=None):
+                cols = QColumns(vocab)
+                if len(rows) == 0:
+                        return cols
+                fields = list(zip(*rows))
+
+                cols.time = QColumns.parseTimes(fields[QDB.timestamp])
+                cols.lat = QColumns.parseFloats(fields[QDB.lat])
+                cols.lon = QColumns.parseFloats(fields[QDB.lon])
+                cols.depth = QColumns.parseFloats(fields[QDB.depth]) / _EARTH_RADIUS
+                cols.mag = QColumns.parseFloats(fields[QDB.mag])
+                cols.x, cols.y, cols.z = QColumns.sphToEuc(cols.lat, cols.lon)
+                cols.updated = QColumns.parseTimes(fields[QDB.updated])
+                cols.nst = QColumns.parseFloats(fields[QDB.nst])
+                cols.gap = QColumns.parseFloats(fields[QDB.gap])
+                cols.dmin = QColumns.parseFloats(fields[QDB.dmin])
+                cols.rms = QColumns.parseFloats(fields[QDB.rms])
+                cols.net = cols.encode("net", fields[QDB.net])
+                cols.magType = cols.encode("magType", fields[QDB.magType])
+                cols.type = cols.encode("type", fields[QDB.type])
+                cols.id = np.array(fields[QDB.id], "S")
+                cols.place = np.array(fields[QDB.place], "S")
+                return cols
+
+        @staticmethod
+        def parseTimes(values):
+                # same characters QEntry.toTime looks at, fractions dropped
+                stamps = np.array([v[:19] for v in values], "datetime64[s]")
+                return stamps.astype(np.int64)
+
+        @staticmethod
+        def parseFloats(values, dtype=np.float64):
+                return np.array([v or "nan" for v in values], np.float64).astype(dtype)
+
+        @staticmethod
+        def optional(value):
+                # empty csv cells are stored as NaN; float64 holds the
+                # csv value exactly, e.g. "1.15" comes back as 1.15
+                if value != value:
+                        return ""
+                return float(value)
+
+        @staticmethod
+        def sphToEuc(degLat, degLon):
+                lat = np.radians(degLat)
+                lon = np.radians(degLon)
+                x = np.cos(lat) * np.sin(lon)
+                y = np.sin(lat)
+                z = np.cos(lat) * np.cos(lon)
+                norm = np.sqrt(x * x + y * y + z * z)
+                return x / norm, y / norm, z / norm
+
+        def encode(self, name, values):
+                words = self.vocab[name]
+                lookup = dict((w, code) for code, w in enumerate(words))
+                codes = np.empty(len(values), np.int16)
+                for i, v in enumerate(values):
+                        code = lookup.get(v)
+                        if code is None:
+                                code = len(words)
+                                words.append(v)
+                                lookup[v] = code
+                        codes[i] = code
+                return codes
+
+        def decode(self, name, i):
+                return self.vocab[name][getattr(self, name)[i]]
+
+        @staticmethod
+        def Concat(lstCols):
+                if len(lstCols) == 0:
+                        return QColumns()
+                cols = QColumns(lstCols[0].vocab)
+                for name in QColumns.names():
+                        setattr(cols, name, np.concatenate([getattr(c, name) for c in lstCols]))
+                return cols
+
+        def withVocab(self, vocab):
+                # coded columns recoded into vocab (extended as needed), the rest shared
+                cols = QColumns(vocab)
+                for name in QColumns.names():
+                        setattr(cols, name, getattr(self, name))
+                for name in QColumns.CODED:
+                        words = vocab[name]
+                        remap = np.zeros(max(1, len(self.vocab[name])), np.int16)
+                        for code, word in enumerate(self.vocab[name]):
+                                if word not in words:
+                                        words.append(word)
+                                remap[code] = words.index(word)
+                        setattr(cols, name, remap[getattr(self, name)])
+                cols.sorted = self.sorted
+                cols.unique = self.unique
+                return cols
+
+        @staticmethod
+        def Merge(lstCols, withRows=False):
+                # time sorted inputs; a duplicate id keeps its latest updated row (the
+                # later input on ties). withRows also returns each input's merged rows,
+                # -1 where dropped
+                vocab = QColumns().vocab
+                parts = [(j, c.withVocab(vocab)) for j, c in enumerate(lstCols) if len(c) > 0]
+                if len(parts) == 0:
+                        if withRows:
+                                return QColumns(), [np.zeros(0, np.intp) for c in lstCols]
+                        return QColumns()
+
+                # runs of (input, row) cursors merged pairwise, neighbours first so
+                # a later run always holds the later inputs; duplicates are dropped
+                # at each step, leaving only the rows that are kept
+                runs = [QColumns._run(j, c) if c.unique else QColumns._dedupe(QColumns._run(j, c))
+                        for j, c in parts]
+                while len(runs) > 1:
+                        merged = [QColumns._mergeRuns(runs[i], runs[i + 1])
+                                  for i in range(0, len(runs) - 1, 2)]
+                        if len(runs) % 2:
+                                merged.append(runs[-1])
+                        runs = merged
+                src, row = runs[0][0], runs[0][1]
+
+                # each column is written once, straight into the merged order
+                picks = [(j, c, np.flatnonzero(src == j)) for j, c in parts]
+                cols = QColumns(vocab)
+                for name in QColumns.names():
+                        arrays = [getattr(c, name) for j, c in parts]
+                        out = np.empty(len(src), np.result_type(*arrays))
+                        for j, c, at in picks:
+                                out[at] = getattr(c, name)[row[at]]
+                        setattr(cols, name, out)
+                cols.sorted = True
+                cols.unique = True
+                if not withRows:
+                        return cols
+
+                rowMaps = [np.full(len(c), -1, np.intp) for c in lstCols]
+                for j, c, at in picks:
+                        rowMaps[j][row[at]] = at
+                return cols, rowMaps
+
+        @staticmethod
+        def _run(j, cols):
+                # cursor arrays: input, row, time, id, updated
+                n = len(cols)
+                return (np.full(n, j, np.intp), np.arange(n), cols.time, cols.id, cols.updated)
+
+        @staticmethod
+        def _dedupe(run):
+                # one row per id within a run: the latest updated, then the later row
+                src, row, time, ids, updated = run
+                rank = np.lexsort((np.arange(len(ids)), updated, ids))
+                last = np.ones(len(rank), bool)
+                last[:-1] = ids[rank[1:]] != ids[rank[:-1]]
+                if last.all():
+                        return run
+                keep = np.sort(rank[last])
+                return tuple(a[keep] for a in run)
+
+        @staticmethod
+        def _common(idsA, idsB):
+                # positions of the ids found in both, sorting only the shorter
+                if len(idsA) < len(idsB):
+                        ib, ia = QColumns._common(idsB, idsA)
+                        return ia, ib
+                order = np.argsort(idsB, kind="mergesort")
+                sortedB = idsB[order]
+                at = np.searchsorted(sortedB, idsA)
+                at[at == len(sortedB)] = 0
+                ia = np.flatnonzero(sortedB[at] == idsA) if len(sortedB) else np.zeros(0, np.intp)
+                return ia, order[at[ia]]
+
+        @staticmethod
+        def _mergeRuns(a, b):
+                # stable merge of two runs sorted by time, b from later inputs; an id
+                # in both stays where its latest update is, b's on ties
+                ia, ib = QColumns._common(a[3], b[3])
+                if len(ia):
+                        older = a[4][ia] <= b[4][ib]
+                        keepA = np.ones(len(a[0]), bool)
+                        keepA[ia[older]] = False
+                        keepB = np.ones(len(b[0]), bool)
+                        keepB[ib[~older]] = False
+                        a = tuple(x[keepA] for x in a)
+                        b = tuple(x[keepB] for x in b)
+                ta = a[2]
+                tb = b[2]
+                at = np.searchsorted(tb, ta, "left") + np.arange(len(ta))
+                bt = np.searchsorted(ta, tb, "right") + np.arange(len(tb))
+                out = []
+                for x, y in zip(a, b):
+                        merged = np.empty(len(ta) + len(tb), np.result_type(x, y))
+                        merged[at] = x
+                        merged[bt] = y
+                        out.append(merged)
+                return tuple(out)
+
+        def take(self, idx):
+                cols = QColumns(self.vocab)
+                for name in QColumns.names():
+                        setattr(cols, name, getattr(self, name)[idx])
+                if self.cluster is not None:
+                        cols.cluster = self.cluster[idx]
+                        cols.mainshock = self.mainshock[idx]
+                return cols
+
+        def sortedByTime(self):
+                # reversed first as the feeds come newest first, keeping tie order
+                last = len(self) - 1
+                order = last - np.argsort(self.time[::-1], kind="mergesort")
+                cols = self.take(order)
+                cols.sorted = True
+                return cols
+
+        def timeSlice(self, tLow, tHigh):
+                # inclusive, on sorted columns
+                lo = np.searchsorted(self.time, int(math.ceil(tLow)), "left")
+                hi = np.searchsorted(self.time, int(math.floor(tHigh)), "right")
+                return int(lo), int(max(lo, hi))
+
+        def dayOffsets(self):
+                # start row of each UTC day plus len(), on sorted columns
+                days = self.time // 86400
+                starts = np.flatnonzero(days[1:] != days[:-1]) + 1
+                return np.concatenate(([0], starts, [len(self)])).astype(np.intp)
+
+        def capMask(self, lat, lon, degRadius, idx=None):
+                c = QEntry.sphToEuc(lat, lon)
+                dot = self.column("x", idx) * c.x + \
+                      self.column("y", idx) * c.y + \
+                      self.column("z", idx) * c.z
+                return dot >= math.cos(math.radians(degRadius))
+
+        def withinCap(self, lat, lon, degRadius, idx=None):
+                if idx is None and self.sphereIndex is not None:
+                        return self.sphereIndex.query(lat, lon, degRadius)
+                m = self.capMask(lat, lon, degRadius, idx)
+                if idx is None:
+                        return np.flatnonzero(m)
+                return idx[m]
+
+        def centroid(self, idx=None, weighted=False):
+                # mean unit vector, so right across the antimeridian; None if empty
+                p = np.column_stack((self.column("x", idx), self.column("y", idx), self.column("z", idx)))
+                w = self.column("mag", idx) if weighted else None
+                return QColumns._direction(QColumns._sum(p, w))
+
+        def hotspot(self, idx=None, weighted=False, degRadius=10.0, iterations=3):
+                # mean shift from the heaviest cell about degRadius across
+                p = np.column_stack((self.column("x", idx), self.column("y", idx), self.column("z", idx)))
+                if len(p) == 0:
+                        return None
+                w = self.column("mag", idx) if weighted else np.ones(len(p))
+
+                # seed: heaviest cell of a grid about degRadius on a side
+                lat = np.degrees(np.arcsin(np.clip(p[:, 1], -1, 1)))
+                lon = np.degrees(np.arctan2(p[:, 0], p[:, 2]))
+                nLat = max(1, int(math.ceil(180.0 / degRadius)))
+                nLon = max(1, int(math.ceil(360.0 / degRadius)))
+                row = np.minimum(((lat + 90) / degRadius).astype(np.intp), nLat - 1)
+                col = np.minimum(((lon + 180) / degRadius).astype(np.intp), nLon - 1)
+                cells = row * nLon + col
+                heaviest = np.argmax(np.bincount(cells, w))
+                center = QColumns._sum(p[cells == heaviest], w[cells == heaviest])
+
+                cosRadius = math.cos(math.radians(degRadius))
+                for i in range(iterations):
+                        norm = np.sqrt(np.dot(center, center))
+                        if norm == 0:
+                                break
+                        near = p.dot(center / norm) >= cosRadius
+                        if not near.any():
+                                break
+                        center = QColumns._sum(p[near], w[near])
+                return QColumns._direction(center)
+
+        @staticmethod
+        def _sum(p, w=None):
+                if w is None:
+                        return p.sum(axis=0)
+                return (p * w[:, np.newaxis]).sum(axis=0)
+
+        @staticmethod
+        def _direction(v):
+                r = math.sqrt(float(np.dot(v, v)))
+                if r < 1e-12:
+                        return None
+                return (math.degrees(math.asin(max(-1.0, min(1.0, v[1] / r)))),
+                        math.degrees(math.atan2(v[0], v[2])))
+
+        @staticmethod
+        def aftershockWindow(mag):
+                # Gardner-Knopoff (1974): (degrees, seconds)
+                mag = np.asarray(mag, np.float64)
+                km = 10 ** (0.1238 * mag + 0.983)
+                days = np.where(mag >= 6.5, 10 ** (0.032 * mag + 2.7389), 10 ** (0.5409 * mag - 0.547))
+                return np.degrees(km / _EARTH_RADIUS), days * 86400
+
+        def decluster(self, indexAbove=4096, since=None):
+                # Gardner-Knopoff: largest events first, each taking in the unassigned
+                # events in its window after it. Long windows use the sphere index.
+                # With since, only rows from that time on changed: the earlier ones
+                # keep the cluster and mainshock they have, as nothing later can
+                # change them, and only their mainshocks reaching since run again
+                n = len(self)
+                degRadius, seconds = QColumns.aftershockWindow(self.mag)
+                cosRadius = np.cos(np.radians(degRadius))
+                starts = self.time
+                stops = self.time + seconds.astype(np.int64)
+
+                first = 0
+                if since is not None:
+                        first = int(np.searchsorted(self.time, since, "left"))
+                cluster = np.full(n, -1, np.int32)
+                mainshock = np.zeros(n, bool)
+                todo = np.arange(n)
+                nClusters = 0
+                if first > 0:
+                        cluster[:first] = self.cluster[:first]
+                        mainshock[:first] = self.mainshock[:first]
+                        nClusters = int(cluster[:first].max()) + 1
+                        reaching = np.flatnonzero(mainshock[:first] & (stops[:first] >= since))
+                        todo = np.concatenate((reaching, todo[first:]))
+
+                for i in todo[np.lexsort((self.time[todo], -self.mag[todo]))]:
+                        if i < first:
+                                # a mainshock before since
+                                label = cluster[i]
+                        elif cluster[i] >= 0:
+                                continue
+                        else:
+                                label = nClusters
+                                nClusters += 1
+                                cluster[i] = label
+                                mainshock[i] = True
+
+                        lo = np.searchsorted(self.time, starts[i], "left")
+                        hi = np.searchsorted(self.time, stops[i], "right")
+                        if hi - lo > indexAbove and self.sphereIndex is not None:
+                                rows = self.sphereIndex.query(self.lat[i], self.lon[i], degRadius[i])
+                                rows = rows[np.searchsorted(rows, lo):np.searchsorted(rows, hi)]
+                        else:
+                                rows = np.arange(lo, hi)
+                                dot = self.x[rows] * self.x[i] + self.y[rows] * self.y[i] + self.z[rows] * self.z[i]
+                                rows = rows[dot >= cosRadius[i]]
+                        rows = rows[cluster[rows] < 0]
+                        cluster[rows] = label
+
+                self.cluster = cluster
+                self.mainshock = mainshock
+                return nClusters
+
+        def valueRows(self, name, lstValues, idx=None):
+                if self.categoryIndex is not None:
+                        bm = self.categoryIndex.values(name, lstValues)
+                        if idx is None:
+                                return bm.toIndices()
+                        return (bm & QBitmap.FromIndices(idx)).toIndices()
+                m = self.valueMask(name, lstValues, idx)
+                if idx is None:
+                        return np.flatnonzero(m)
+                return idx[m]
+
+        def valueMask(self, name, lstValues, idx=None):
+                words = self.vocab[name]
+                codes = [words.index(v) for v in lstValues if v in words]
+                return np.isin(self.column(name, idx), codes)
+
+        def placeRows(self, text, idx=None):
+                if self.categoryIndex is not None:
+                        bm = self.categoryIndex.placeCandidates(text)
+                        if bm is not None:
+                                if idx is not None:
+                                        bm = bm & QBitmap.FromIndices(idx)
+                                idx = bm.toIndices()
+                m = self.placeMask(text, idx)
+                if idx is None:
+                        return np.flatnonzero(m)
+                return idx[m]
+
+        def placeMask(self, text, idx=None):
+                return np.char.find(self.column("place", idx), text) >= 0
+
+        def entry(self, i):
+                return QEntry.FromColumns(self, i)
+
+        def save(self, path):
+                if not os.path.isdir(path):
+                        os.makedirs(path)
+                for name in QColumns.names():
+                        np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+                for name in QColumns.CODED:
+                        words = np.array(self.vocab[name], "S")
+                        np.save(os.path.join(path, "vocab_" + name + ".npy"), words)
+
+        @staticmethod
+        def Load(path, mmap=True):
+                # with mmap the arrays are read-only views of the files
+                mode = "r" if mmap else None
+                vocab = {}
+                for name in QColumns.CODED:
+                        words = np.load(os.path.join(path, "vocab_" + name + ".npy"))
+                        vocab[name] = [str(w) for w in words]
+                cols = QColumns(vocab)
+                for name in QColumns.names():
+                        setattr(cols, name, np.load(os.path.join(path, name + ".npy"), mmap_mode=mode))
+                return cols
+
+        def column(self, name, idx=None):
+                col = getattr(self, name)
+                if idx is None:
+                        return col
+                return col[idx]
+
+        def sample(self, size=1024):
+                step = max(1, len(self) // size)
+                return np.arange(0, len(self), step)
+
+################################################################################
+
+class QCellGrid(object):
+        # latitude bands cellDeg high, each cut into as many bins as fit
+        # cellDeg wide on its center line
+
+        def __init__(self, cellDeg=2.0):
+                self._cellDeg = cellDeg
+                self._nBands = int(math.ceil(180.0 / cellDeg))
+
+                centers = -90 + (np.arange(self._nBands) + 0.5) * cellDeg
+                self._bandBins = np.maximum(1, np.round(360.0 * np.cos(np.radians(centers)) / cellDeg)).astype(np.intp)
+                self._bandStart = np.concatenate(([0], np.cumsum(self._bandBins))).astype(np.intp)
+
+        def __len__(self):
+                return int(self._bandStart[-1])
+
+        def cells(self, lat, lon):
+                band = np.clip(((lat + 90) // self._cellDeg).astype(np.intp), 0, self._nBands - 1)
+                bins = self._bandBins[band]
+                lonBin = np.floor((lon + 180) * bins / 360.0).astype(np.intp) % bins
+                return self._bandStart[band] + lonBin
+
+        def aggregate(self, cols, idx=None):
+                cells = self.cells(cols.column("lat", idx), cols.column("lon", idx))
+                order = np.argsort(cells, kind="mergesort")
+                cells = cells[order]
+                starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+                if len(cells) == 0:
+                        starts = np.zeros(0, np.intp)
+
+                stats = QCellStats(self._cellDeg)
+                stats.cell = cells[starts]
+                stats.count = np.diff(np.append(starts, len(cells)))
+                stats.mag = np.maximum.reduceat(cols.column("mag", idx)[order], starts) if len(starts) else np.zeros(0)
+                depth = cols.column("depth", idx)[order]
+                stats.depth = np.add.reduceat(depth, starts) / stats.count if len(starts) else np.zeros(0)
+
+                # columns stand on the mean position of their events
+                p = np.column_stack((cols.column("x", idx), cols.column("y", idx), cols.column("z", idx)))[order]
+                if len(starts):
+                        p = np.add.reduceat(p, starts)
+                        p /= np.sqrt((p * p).sum(axis=1))[:, np.newaxis]
+                stats.x = p[:, 0]
+                stats.y = p[:, 1]
+                stats.z = p[:, 2]
+                return stats
+
+
+class QCellStats(object):
+        # per non-empty cell: id, count, largest mag, mean depth, mean position
+
+        def __init__(self, cellDeg):
+                self.cellDeg = cellDeg
+                self.cell = np.zeros(0, np.intp)
+                self.count = np.zeros(0, np.intp)
+                self.mag = np.zeros(0)
+                self.depth = np.zeros(0)
+                self.x = np.zeros(0)
+                self.y = np.zeros(0)
+                self.z = np.zeros(0)
+
+        def __len__(self):
+                return len(self.cell)
+
+################################################################################
+
+class QSphereIndex(QCellGrid):
+        # rows grouped by cell so a cap query only tests the nearby cells
+
+        def __init__(self, cols, cellDeg=2.0, cells=None, order=None):
+                # cells and order, when known, are the rows of cols by cell and
+                # their cells
+                QCellGrid.__init__(self, cellDeg)
+                self._cols = cols
+                nCells = len(self)
+
+                if order is None:
+                        cells = self.cells(cols.lat, cols.lon)
+                        order = np.argsort(cells, kind="mergesort")
+                        cells = cells[order]
+                self._order = order
+                self._cellStart = np.searchsorted(cells, np.arange(nCells + 1))
+
+                # positions in cell order, so a run of cells is a plain slice
+                self._x = cols.x[self._order]
+                self._y = cols.y[self._order]
+                self._z = cols.z[self._order]
+
+        @staticmethod
+        def Merge(cols, indexes, rowMaps):
+                # index of cols from those of the parts QColumns.Merge took, rowMaps
+                # as it returned; the parts' rows are moved, not sorted again
+                cellDeg = indexes[0]._cellDeg
+                cells = np.zeros(0, np.intp)
+                order = np.zeros(0, np.intp)
+                for part, rowMap in zip(indexes, rowMaps):
+                        rows = rowMap[part._order]
+                        partCells = np.repeat(np.arange(len(part)), np.diff(part._cellStart))
+                        kept = rows >= 0
+                        rows = rows[kept]
+                        partCells = partCells[kept]
+
+                        at = np.searchsorted(partCells, cells, "left") + np.arange(len(cells))
+                        pt = np.searchsorted(cells, partCells, "right") + np.arange(len(partCells))
+                        merged = np.empty(len(at) + len(pt), np.intp)
+                        merged[at] = cells
+                        merged[pt] = partCells
+                        cells = merged
+                        merged = np.empty(len(at) + len(pt), np.intp)
+                        merged[at] = order
+                        merged[pt] = rows
+                        order = merged
+                return QSphereIndex(cols, cellDeg, cells, order)
+
+        def query(self, lat, lon, degRadius):
+                latLow = lat - degRadius
+                latHigh = lat + degRadius
+                bLow = max(0, int((latLow + 90) // self._cellDeg))
+                bHigh = min(self._nBands - 1, int((latHigh + 90) // self._cellDeg))
+
+                # widest longitude reach of the cap, unless it holds a pole
+                full = latLow <= -90 or latHigh >= 90
+                if not full:
+                        s = math.sin(math.radians(degRadius)) / math.cos(math.radians(lat))
+                        full = s >= 1
+                if not full:
+                        reach = math.degrees(math.asin(s))
+
+                runs = []
+                for band in range(bLow, bHigh + 1):
+                        bins = self._bandBins[band]
+                        first = self._bandStart[band]
+                        if full:
+                                runs.append((first, first + bins))
+                                continue
+                        b0 = int(math.floor((lon - reach + 180) * bins / 360.0))
+                        b1 = int(math.floor((lon + reach + 180) * bins / 360.0))
+                        if b1 - b0 + 1 >= bins:
+                                runs.append((first, first + bins))
+                                continue
+                        b0 %= bins
+                        b1 %= bins
+                        if b0 <= b1:
+                                runs.append((first + b0, first + b1 + 1))
+                        else:
+                                runs.append((first + b0, first + bins))
+                                runs.append((first, first + b1 + 1))
+
+                # same test as QColumns.capMask, on each run of cells
+                c = QEntry.sphToEuc(lat, lon)
+                cosRadius = math.cos(math.radians(degRadius))
+                hits = [np.zeros(0, np.intp)]
+                for c0, c1 in runs:
+                        s0 = self._cellStart[c0]
+                        s1 = self._cellStart[c1]
+                        if s0 == s1:
+                                continue
+                        dot = self._x[s0:s1] * c.x + self._y[s0:s1] * c.y + self._z[s0:s1] * c.z
+                        hits.append(self._order[s0:s1][dot >= cosRadius])
+                return np.sort(np.concatenate(hits))
+
+################################################################################
+
+class QBitmap(object):
+        # roaring style: chunks of 65536 rows, sparse ones as uint16 low bits,
+        # dense ones as bitsets
+
+        SPARSE = 4096
+        _CHUNK = 1 << 16
+
+        def __init__(self):
+                # high bits -> uint16 array (sparse) or packed uint8 bitset
+                self._chunks = {}
+
+        @staticmethod
+        def FromIndices(idx):
+                # idx ascending
+                bm = QBitmap()
+                idx = np.asarray(idx, np.int64)
+                if len(idx) == 0:
+                        return bm
+                high = idx >> 16
+                starts = np.flatnonzero(high[1:] != high[:-1]) + 1
+                bounds = np.concatenate(([0], starts, [len(idx)]))
+                for i in range(len(bounds) - 1):
+                        low = (idx[bounds[i]:bounds[i + 1]] & 0xFFFF).astype(np.uint16)
+                        bm._chunks[int(high[bounds[i]])] = QBitmap._container(low)
+                return bm
+
+        @staticmethod
+        def _container(low):
+                if len(low) <= QBitmap.SPARSE:
+                        return low
+                bits = np.zeros(QBitmap._CHUNK, bool)
+                bits[low] = True
+                return np.packbits(bits)
+
+        @staticmethod
+        def _lows(container):
+                if container.dtype == np.uint16:
+                        return container
+                return np.flatnonzero(np.unpackbits(container)).astype(np.uint16)
+
+        @staticmethod
+        def _bits(container):
+                if container.dtype == np.uint8:
+                        return container
+                bits = np.zeros(QBitmap._CHUNK, bool)
+                bits[container] = True
+                return np.packbits(bits)
+
+        def __len__(self):
+                count = 0
+                for c in self._chunks.values():
+                        if c.dtype == np.uint16:
+                                count += len(c)
+                        else:
+                                count += int(np.unpackbits(c).sum())
+                return count
+
+        def __and__(self, other):
+                result = QBitmap()
+                for key, a in self._chunks.items():
+                        b = other._chunks.get(key)
+                        if b is None:
+                                continue
+                        if a.dtype == np.uint16 and b.dtype == np.uint16:
+                                low = np.intersect1d(a, b, assume_unique=True).astype(np.uint16)
+                        elif a.dtype == np.uint16 or b.dtype == np.uint16:
+                                sparse, dense = (a, b) if a.dtype == np.uint16 else (b, a)
+                                hit = (dense[sparse >> 3] >> (7 - (sparse & 7)).astype(np.uint8)) & 1
+                                low = sparse[hit.astype(bool)]
+                        else:
+                                low = QBitmap._lows(a & b)
+                        if len(low):
+                                result._chunks[key] = QBitmap._container(low)
+                return result
+
+        def __or__(self, other):
+                result = QBitmap()
+                for key in set(self._chunks) | set(other._chunks):
+                        a = self._chunks.get(key)
+                        b = other._chunks.get(key)
+                        if a is None or b is None:
+                                result._chunks[key] = a if b is None else b
+                        elif a.dtype == np.uint16 and b.dtype == np.uint16:
+                                result._chunks[key] = QBitmap._container(np.union1d(a, b).astype(np.uint16))
+                        else:
+                                result._chunks[key] = QBitmap._bits(a) | QBitmap._bits(b)
+                return result
+
+        @staticmethod
+        def Union(bitmaps):
+                result = QBitmap()
+                for bm in bitmaps:
+                        result = result | bm
+                return result
+
+        def toIndices(self):
+                parts = [np.zeros(0, np.intp)]
+                for key in sorted(self._chunks):
+                        low = QBitmap._lows(self._chunks[key]).astype(np.intp)
+                        parts.append(low + (key << 16))
+                return np.concatenate(parts)
+
+        def remap(self, rowMap, stable=0):
+                # rowMap increasing apart from -1s (dropped); chunks below stable keep
+                # their rows and are reused
+                first = stable >> 16
+                result = QBitmap()
+                tail = QBitmap()
+                for key, c in self._chunks.items():
+                        if key < first:
+                                result._chunks[key] = c
+                        else:
+                                tail._chunks[key] = c
+                if len(tail._chunks) == 0:
+                        return self
+                rows = rowMap[tail.toIndices()]
+                # rows past stable map past it too, so no chunk collides
+                result._chunks.update(QBitmap.FromIndices(rows[rows >= 0])._chunks)
+                return result
+
+        @staticmethod
+        def Pack(bitmaps):
+                # table rows: (bitmap, high bits, dense, start, length) per chunk
+                table = []
+                blobs = ([], [])
+                sizes = [0, 0]
+                for n, bm in enumerate(bitmaps):
+                        for key in sorted(bm._chunks):
+                                c = bm._chunks[key]
+                                dense = int(c.dtype == np.uint8)
+                                table.append((n, key, dense, sizes[dense], len(c)))
+                                blobs[dense].append(c)
+                                sizes[dense] += len(c)
+                sparse = np.concatenate([np.zeros(0, np.uint16)] + blobs[0])
+                dense = np.concatenate([np.zeros(0, np.uint8)] + blobs[1])
+                return np.array(table, np.int64).reshape(-1, 5), sparse, dense
+
+        @staticmethod
+        def Unpack(table, sparse, dense, count):
+                # chunks are views of sparse and dense
+                bitmaps = [QBitmap() for n in range(count)]
+                blobs = (sparse, dense)
+                for n, key, isDense, start, length in table.tolist():
+                        bitmaps[n]._chunks[key] = blobs[isDense][start:start + length]
+                return bitmaps
+
+################################################################################
+
+class QCategoryIndex(object):
+        # bitmaps of the rows of each coded value and of each place word
+
+        _WORD = re.compile(r"[A-Za-z]+")
+
+        def __init__(self, cols=None):
+                self._values = dict((name, {}) for name in QColumns.CODED)
+                self._words = {}
+                if cols is None:
+                        return
+                for name in QColumns.CODED:
+                        codes = getattr(cols, name)
+                        bitmaps = QCategoryIndex._groups(codes, len(cols.vocab[name]))
+                        self._values[name] = dict(zip(cols.vocab[name], bitmaps))
+
+                # words of each distinct place, then rows of each word
+                places, inverse = np.unique(cols.place, return_inverse=True)
+                byPlace = QCategoryIndex._groupRows(inverse, len(places))
+                words = {}
+                for p, place in enumerate(places):
+                        for word in set(QCategoryIndex._WORD.findall(place)):
+                                words.setdefault(word.lower(), []).append(p)
+                for word, lstPlaces in words.items():
+                        rows = np.sort(np.concatenate([byPlace[p] for p in lstPlaces]))
+                        self._words[word] = QBitmap.FromIndices(rows)
+
+        @staticmethod
+        def _groupRows(codes, count):
+                # ascending rows of each code 0..count-1
+                order = np.argsort(codes, kind="mergesort")
+                bounds = np.searchsorted(codes[order], np.arange(count + 1))
+                return [order[bounds[c]:bounds[c + 1]] for c in range(count)]
+
+        @staticmethod
+        def _groups(codes, count):
+                return [QBitmap.FromIndices(rows) for rows in QCategoryIndex._groupRows(codes, count)]
+
+        def _keys(self):
+                # (name, value) of every bitmap, "" naming the place words
+                keys = [(name, v) for name in QColumns.CODED for v in self._values[name]]
+                return keys + [("", w) for w in self._words]
+
+        def _bitmap(self, key):
+                if key[0] == "":
+                        return self._words[key[1]]
+                return self._values[key[0]][key[1]]
+
+        def _set(self, key, bm):
+                if key[0] == "":
+                        self._words[key[1]] = bm
+                else:
+                        self._values[key[0]][key[1]] = bm
+
+        @staticmethod
+        def Merge(indexes, rowMaps):
+                # rowMaps as from QColumns.Merge; parts whose rows keep their numbers
+                # reuse their bitmaps
+                index = QCategoryIndex()
+                for part, rowMap in zip(indexes, rowMaps):
+                        # rows before the first one to move keep their bitmaps
+                        moved = np.flatnonzero(rowMap != np.arange(len(rowMap)))
+                        stable = int(moved[0]) if len(moved) else len(rowMap)
+                        for key in part._keys():
+                                bm = part._bitmap(key)
+                                if stable < len(rowMap):
+                                        bm = bm.remap(rowMap, stable)
+                                try:
+                                        bm = index._bitmap(key) | bm
+                                except KeyError:
+                                        pass
+                                index._set(key, bm)
+                return index
+
+        def save(self, path):
+                keys = self._keys()
+                table, sparse, dense = QBitmap.Pack([self._bitmap(k) for k in keys])
+                np.save(os.path.join(path, "category_table.npy"), table)
+                np.save(os.path.join(path, "category_sparse.npy"), sparse)
+                np.save(os.path.join(path, "category_dense.npy"), dense)
+                with open(os.path.join(path, "category_keys.json"), "w") as f:
+                        json.dump(keys, f)
+
+        @staticmethod
+        def Load(path, mmap=True):
+                # raises IOError when there is none
+                mode = "r" if mmap else None
+                with open(os.path.join(path, "category_keys.json")) as f:
+                        keys = [(str(name), str(v)) for name, v in json.load(f)]
+                table = np.load(os.path.join(path, "category_table.npy"))
+                sparse = np.load(os.path.join(path, "category_sparse.npy"), mmap_mode=mode)
+                dense = np.load(os.path.join(path, "category_dense.npy"), mmap_mode=mode)
+                index = QCategoryIndex()
+                for key, bm in zip(keys, QBitmap.Unpack(table, sparse, dense, len(keys))):
+                        index._set(key, bm)
+                return index
+
+        def values(self, name, lstValues):
+                bitmaps = self._values[name]
+                return QBitmap.Union([bitmaps[v] for v in lstValues if v in bitmaps])
+
+        def placeCandidates(self, text):
+                # superset of the matches, None when text has no words
+                result = None
+                for part in QCategoryIndex._WORD.findall(text):
+                        part = part.lower()
+                        hits = QBitmap.Union([bm for word, bm in self._words.items() if part in word])
+                        result = hits if result is None else result & hits
+                return result
+
+################################################################################
+
+class QEntryView(object):
+        # QEntry objects built on access
+
+        def __init__(self, cols, idx=None):
+                self._cols = cols
+                self._idx = idx
+
+        def __len__(self):
+                if self._idx is None:
+                        return len(self._cols)
+                return len(self._idx)
+
+        def __getitem__(self, i):
+                if isinstance(i, slice):
+                        return QEntryView(self._cols, self.Indices()[i])
+                if i < 0:
+                        i += len(self)
+                if i < 0 or i >= len(self):
+                        raise IndexError("QEntryView index out of range")
+                if self._idx is not None:
+                        i = self._idx[i]
+                return self._cols.entry(i)
+
+        def __iter__(self):
+                for i in range(len(self)):
+                        yield self[i]
+
+        def Indices(self):
+                if self._idx is None:
+                        return np.arange(len(self._cols))
+                return self._idx
+
+        def Columns(self):
+                if self._idx is None:
+                        return self._cols
+                return self._cols.take(self._idx)
+
+        def Source(self):
+                # (columns viewed, their rows or None for all), nothing copied
+                return self._cols, self._idx
+
+################################################################################
+
+class QTimeBuckets(object):
+        # every day/week/month/year, empty ones included; bucket k is rows
+        # offsets[k]:offsets[k + 1] of cols. Weeks start on Monday
+
+        UNITS = ("day", "week", "month", "year")
+
+        def __init__(self, cols, unit="day"):
+                if unit not in QTimeBuckets.UNITS:
+                        raise ValueError("unknown bucket unit " + str(unit))
+                self.unit = unit
+                self.cols = cols
+
+                ids = QTimeBuckets._ids(cols.time, unit)
+                if len(ids) == 0:
+                        self.base = 0
+                        n = 0
+                else:
+                        self.base = int(ids[0])
+                        n = int(ids[-1]) - self.base + 1
+                self.offsets = np.searchsorted(ids, np.arange(self.base, self.base + n + 1)).astype(np.intp)
+                self.offsets[-1] = len(cols)
+                self.count = np.diff(self.offsets)
+
+                # running sums over the rows, so a run of buckets sums in O(1)
+                self._cum = np.zeros((len(cols) + 1, 3), np.float64)
+                np.cumsum(np.column_stack((cols.x, cols.y, cols.z)), axis=0, out=self._cum[1:])
+
+                self.magMax = np.full(n, np.nan)
+                full = np.flatnonzero(self.count > 0)
+                if len(full):
+                        self.magMax[full] = np.maximum.reduceat(cols.mag, self.offsets[full])
+
+                # nearest non-empty bucket at or after / at or before each one
+                nxt = np.full(n + 1, n, np.intp)
+                prv = np.full(n + 1, -1, np.intp)
+                nxt[full] = full
+                prv[full] = full
+                self._next = np.minimum.accumulate(nxt[::-1])[::-1]
+                self._prev = np.maximum.accumulate(prv)
+
+        @staticmethod
+        def _ids(t, unit):
+                # bucket number of epoch seconds, counted from 1970
+                t = np.asarray(t, np.int64)
+                if unit == "day":
+                        return t // 86400
+                if unit == "week":
+                        # 1970-01-01 was a Thursday
+                        return (t // 86400 + 3) // 7
+                if unit == "month":
+                        return t.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+                return t.astype("datetime64[s]").astype("datetime64[Y]").astype(np.int64)
+
+        def __len__(self):
+                return len(self.count)
+
+        def bucketOf(self, dt):
+                # may be outside 0..len()-1
+                return int(QTimeBuckets._ids(np.array([int(toEpoch(dt))]), self.unit)[0]) - self.base
+
+        def start(self, k):
+                k = self.base + k
+                if self.unit == "day":
+                        return fromEpoch(k * 86400)
+                if self.unit == "week":
+                        return fromEpoch((k * 7 - 3) * 86400)
+                if self.unit == "month":
+                        return datetime.datetime(1970 + k // 12, k % 12 + 1, 1)
+                return datetime.datetime(1970 + k, 1, 1)
+
+        def rows(self, lo, hi=None):
+                # (start, stop) of buckets lo..hi-1, or just lo
+                if hi is None:
+                        hi = lo + 1
+                return int(self.offsets[lo]), int(self.offsets[hi])
+
+        def maxCount(self, width):
+                width = min(width, len(self))
+                if width <= 0:
+                        return 0
+                return int((self.offsets[width:] - self.offsets[:-width]).max())
+
+        def nonEmpty(self, k, forward=True):
+                # len() or -1 when there is none
+                if forward:
+                        return int(self._next[min(max(k, 0), len(self))])
+                if k < 0:
+                        return -1
+                return int(self._prev[min(k, len(self) - 1)])
+
+        def centroid(self, lo, hi=None):
+                start, stop = self.rows(lo, hi)
+                if stop <= start:
+                        return None
+                return QColumns._direction(self._cum[stop] - self._cum[start])
+
+################################################################################
+
+class QPlayback(object):
+        # speed is buckets per second, negative plays backwards
+
+        def __init__(self, buckets, speed=1.0, skipEmpty=True):
+                self.buckets = buckets
+                self.speed = speed
+                self.skipEmpty = skipEmpty
+                self._k = 0
+                self._frac = 0.0
+                self._settle()
+
+        def current(self):
+                # -1 or len(buckets) once past either end
+                return self._k
+
+        def done(self):
+                return self._k < 0 or self._k >= len(self.buckets)
+
+        def seek(self, dt):
+                self.seekBucket(self.buckets.bucketOf(dt))
+
+        def seekBucket(self, k):
+                self._k = min(max(int(k), 0), len(self.buckets) - 1)
+                self._frac = 0.0 if self.speed >= 0 else 1.0 - 1e-9
+                self._settle()
+
+        def step(self, seconds):
+                # returns the ascending range of buckets entered, empty if none
+                if self.done():
+                        return (self._k, self._k)
+                before = self._k
+                self._frac += self.speed * seconds
+                n = int(math.floor(self._frac))
+                self._k += n
+                self._frac -= n
+                self._settle()
+                if self._k > before:
+                        return (before + 1, min(self._k + 1, len(self.buckets)))
+                if self._k < before:
+                        return (max(self._k, 0), before)
+                return (before, before)
+
+        def _settle(self):
+                # off the ends stays off; otherwise hop over empty buckets
+                # in the direction of play
+                if not self.skipEmpty or self.done():
+                        return
+                if self.buckets.count[self._k] == 0:
+                        self._k = self.buckets.nonEmpty(self._k, self.speed >= 0)
+
 ################################################################################
 
 class QDB:
 
+        # bump when the QColumns layout changes to invalidate old caches
+        CACHE_VERSION = 2
+        # filter results remembered by queryByFilter
+        QUERY_CACHE = 8
+
         timestamp = 0
         lat = 1
         lon = 2
@@ -75,51 +1219,299 @@ class QDB:
 
 
         def __init__(self, csvFilePath):
-                self._qentries = []
-                self._qsetFile = open(csvFilePath, "rb")
+                # one catalog, or a list of them merged into one
+                if isinstance(csvFilePath, (list, tuple)):
+                        self._paths = list(csvFilePath)
+                else:
+                        self._paths = [csvFilePath]
+                self._path = self._paths[0]
+                self._cols = QColumns()
+                # bumped whenever the rows or derived columns change, so
+                # anything built from the catalog can tell it is stale
+                self.generation = 0
 
                 # stats
-                self.timeLow = datetime.datetime.now()
-                self.timeHigh = datetime.datetime(1, 1, 1)
-                self.depthLow = 99999
-                self.depthHigh = 0
-                self.magLow = 99999
-                self.magHigh = 0
+                self.resetStats()
 
                 # playback
                 self._pos = 0
-                self._date = datetime.date.today()
+                self._dayOffsets = np.zeros(1, np.intp)
+                self._buckets = {}
 
+                # aftershock sequences, kept up to date once asked for
+                self._declustered = False
 
-        def Parse(self):
-                count = 0
-                qreader = csv.reader(self._qsetFile)
+                # recent (filter key, filter, indices, columns queried),
+                # most recent first
+                self._queryCache = []
+                self._queryLock = threading.Lock()
+
+                # refresh: (size, mtime, last bytes) of each catalog as read,
+                # and callbacks told about new rows
+                self._stamps = {}
+                self._listeners = []
+
+
+        def Parse(self, useCache=True, onChunk=None):
+                # onChunk gets each chunk as read (a whole catalog on a cache hit);
+                # several catalogs are merged with duplicates removed
+                lstCols = []
+                for path in self._paths:
+                        lstCols.append(self._parseOne(path, useCache, onChunk))
+
+                if len(lstCols) > 1:
+                        cols, rowMaps = QColumns.Merge(lstCols, withRows=True)
+                        categoryIndex = QCategoryIndex.Merge([c.categoryIndex for c in lstCols], rowMaps)
+                        lstCols = None
+                        self.resetStats()
+                        self.updateStatsColumns(cols)
+                else:
+                        cols = lstCols[0]
+                        categoryIndex = cols.categoryIndex
+
+                self._install(cols, categoryIndex)
+
+
+        def _parseOne(self, path, useCache, onChunk):
+                self._stamps[path] = self._stamp(path)
+                cols = None
+                if useCache:
+                        cols = self._loadCache(path)
+                        if cols is not None:
+                                self.updateStatsColumns(cols)
+                                if onChunk is not None:
+                                        onChunk(cols)
+                                if cols.categoryIndex is None:
+                                        # a cache from before indexes were kept
+                                        cols.categoryIndex = QCategoryIndex(cols)
+                                        self._saveCategoryIndex(cols, path)
+
+                if cols is None:
+                        chunks = []
+                        for chunk in self.Stream(path=path):
+                                if onChunk is not None:
+                                        onChunk(chunk)
+                                chunks.append(chunk)
+                        cols = QColumns.Concat(chunks)
+                        chunks = None
+                        cols = cols.sortedByTime()
+                        cols.categoryIndex = QCategoryIndex(cols)
+                        if useCache:
+                                self._saveCache(cols, path)
+                return cols
 
-                for r in qreader:
-                        #print(r)
-                        if (count == 0):
-                                count = 1
+
+        def Stream(self, chunkSize=65536, path=None, offset=0, lastLine=True):
+                # chunks in file order sharing one vocabulary; offset is a byte past
+                # the header. lastLine False leaves out a last line without its
+                # newline, which the feed may still be writing
+                vocab = QColumns().vocab
+                if path is None:
+                        path = self._path
+                with open(path, "rb") as f:
+                        f.seek(offset)
+                        lines = f
+                        if not lastLine:
+                                lines = (line for line in f if line.endswith(b"\n"))
+                        qreader = csv.reader(lines)
+                        if offset == 0:
+                                next(qreader)   # header
+
+                        while True:
+                                rows = list(itertools.islice(qreader, chunkSize))
+                                if len(rows) == 0:
+                                        break
+                                chunk = QColumns.FromRows(rows, vocab)
+                                rows = None
+                                self.updateStatsColumns(chunk)
+                                yield chunk
+
+
+        def addListener(self, cb):
+                # cb(rows, replaced) after refresh(); replaced masks the rows that
+                # updated an older version
+                self._listeners.append(cb)
+
+
+        def refresh(self):
+                # grown catalogs are read from where they ended, rewritten ones reread
+                # keeping only new or updated ids; returns the rows absorbed
+                order = np.argsort(self._cols.id, kind="mergesort")
+                ids = self._cols.id[order]
+                held = self._cols.updated[order]
+
+                vocab = QColumns().vocab
+                fresh = []
+                for path in self._paths:
+                        old = self._stamps.get(path)
+                        stamp = self._stamp(path)
+                        if old is not None and stamp[:2] == old[:2]:
                                 continue
+                        offset = 0
+                        if old is not None and self._grew(path, old):
+                                offset = old[0]
+                        for chunk in self.Stream(path=path, offset=offset, lastLine=False):
+                                if offset == 0:
+                                        chunk = chunk.take(QDB._newer(chunk, ids, held))
+                                fresh.append(chunk.withVocab(vocab))
+                        self._stamps[path] = stamp
+
+                rows = QColumns.Concat(fresh)
+                if len(rows) == 0:
+                        return 0
+                rows = QColumns.Merge([rows.sortedByTime()])
+                replaced = np.isin(rows.id, self._cols.id)
+
+                # keep playback on the day it was at
+                played = None
+                if self._pos > 0:
+                        played = self._cols.time[self._dayOffsets[self._pos] - 1] // 86400
 
-                        qentry = QEntry(r[0],
-                                        r[1],
-                                        r[2],
-                                        r[3],
-                                        r[4],
-                                        r[5],
-                                        r[6],
-                                        r[7],
-                                        r[8],
-                                        r[9],
-                                        r[10],
-                                        r[11],
-                                        r[12],
-                                        r[13],
-                                        r[14])
-
-                        self._qentries.append(qentry)
-                        self.updateStats(qentry)
-                        count += 1
+                # the indexes take in the new rows rather than being built
+                # again, and aftershocks are only looked for again from the
+                # first row that changed
+                old = self._cols
+                cols, rowMaps = QColumns.Merge([old, rows], withRows=True)
+                categoryIndex = QCategoryIndex.Merge([old.categoryIndex, QCategoryIndex(rows)], rowMaps)
+                sphereIndex = None
+                if old.sphereIndex is not None:
+                        sphereIndex = QSphereIndex.Merge(cols, [old.sphereIndex, QSphereIndex(rows)], rowMaps)
+                since = None
+                if old.cluster is not None:
+                        dropped = rowMaps[0] < 0
+                        since = rows.time[0]
+                        if dropped.any():
+                                since = min(since, old.time[dropped].min())
+                        kept = ~dropped
+                        cols.cluster = np.full(len(cols), -1, np.int32)
+                        cols.mainshock = np.zeros(len(cols), bool)
+                        cols.cluster[rowMaps[0][kept]] = old.cluster[kept]
+                        cols.mainshock[rowMaps[0][kept]] = old.mainshock[kept]
+                self.updateStatsColumns(rows)
+                self._install(cols, categoryIndex, played, sphereIndex, since)
+
+                for cb in self._listeners:
+                        cb(rows, replaced)
+                return len(rows)
+
+        @staticmethod
+        def _newer(cols, ids, held):
+                # rows of cols not in ids (sorted) or updated after held
+                if len(ids) == 0:
+                        return np.ones(len(cols), bool)
+                at = np.minimum(np.searchsorted(ids, cols.id), len(ids) - 1)
+                return (ids[at] != cols.id) | (cols.updated > held[at])
+
+        def _stamp(self, path):
+                st = os.stat(path)
+                with open(path, "rb") as f:
+                        f.seek(max(0, st.st_size - 64))
+                        tail = f.read(64)
+                return (st.st_size, st.st_mtime, tail)
+
+        def _grew(self, path, old):
+                # appended to: longer, and still ending a line where it ended
+                size, mtime, tail = old
+                if os.path.getsize(path) <= size or not tail.endswith(b"\n"):
+                        return False
+                with open(path, "rb") as f:
+                        f.seek(size - len(tail))
+                        return f.read(len(tail)) == tail
+
+
+        def cachePath(self, path=None):
+                if path is None:
+                        path = self._path
+                return path + ".qcache"
+
+        def _cacheKey(self, path):
+                st = os.stat(path)
+                return {"version": QDB.CACHE_VERSION,
+                        "size": st.st_size,
+                        "mtime": st.st_mtime}
+
+        def _loadCache(self, csvPath):
+                # the cache holds the decoded, time sorted columns of the csv
+                # it was built from, valid while size and mtime still match
+                path = self.cachePath(csvPath)
+                try:
+                        with open(os.path.join(path, "key.json")) as f:
+                                key = json.load(f)
+                        if key != self._cacheKey(csvPath):
+                                return None
+                        cols = QColumns.Load(path)
+                except (IOError, OSError, ValueError, KeyError):
+                        return None
+                try:
+                        cols.categoryIndex = QCategoryIndex.Load(path)
+                except (IOError, OSError, ValueError, KeyError):
+                        pass
+                cols.sorted = True
+                return cols
+
+        def _saveCache(self, cols, csvPath):
+                path = self.cachePath(csvPath)
+                tmp = path + ".tmp"
+                try:
+                        if os.path.isdir(tmp):
+                                shutil.rmtree(tmp)
+                        cols.save(tmp)
+                        if cols.categoryIndex is not None:
+                                cols.categoryIndex.save(tmp)
+                        with open(os.path.join(tmp, "key.json"), "w") as f:
+                                json.dump(self._cacheKey(csvPath), f)
+                        if os.path.isdir(path):
+                                shutil.rmtree(path)
+                        os.rename(tmp, path)
+                except (IOError, OSError, ValueError) as e:
+                        print("QDB: could not write cache " + path + ": " + str(e))
+
+        def _saveCategoryIndex(self, cols, csvPath):
+                # adds the index to a cache written without one
+                path = self.cachePath(csvPath)
+                try:
+                        cols.categoryIndex.save(path)
+                except (IOError, OSError, ValueError) as e:
+                        print("QDB: could not write cache " + path + ": " + str(e))
+
+
+        def _install(self, cols, categoryIndex=None, played=None, sphereIndex=None, since=None):
+                # builds the indexes of cols, then makes it the catalog in
+                # one step so a reader never sees the new rows without them.
+                # categoryIndex and sphereIndex, when already known (cached
+                # or merged), are taken as the indexes of cols; played is the
+                # day playback was at; since, with the clusters of the rows
+                # before it set on cols, declusters from there on only
+                dayOffsets = cols.dayOffsets()
+                if sphereIndex is None:
+                        sphereIndex = QSphereIndex(cols)
+                cols.sphereIndex = sphereIndex
+                if categoryIndex is None:
+                        categoryIndex = QCategoryIndex(cols)
+                cols.categoryIndex = categoryIndex
+                if self._declustered:
+                        cols.decluster(since=since)
+                pos = self._pos
+                if played is not None:
+                        days = cols.time[dayOffsets[:-1]] // 86400
+                        pos = int(np.searchsorted(days, played, "right"))
+
+                with self._queryLock:
+                        self._cols = cols
+                        self._dayOffsets = dayOffsets
+                        self._pos = pos
+                        self._buckets = {}
+                        self._queryCache = []
+                        self.generation += 1
+
+
+        def resetStats(self):
+                self.timeLow = datetime.datetime.now()
+                self.timeHigh = datetime.datetime(1, 1, 1)
+                self.depthLow = 99999
+                self.depthHigh = 0
+                self.magLow = 99999
+                self.magHigh = 0
 
 
         def updateStats(self, qe):
@@ -131,43 +1523,147 @@ class QDB:
                 if qe._magnitude > self.magHigh: self.magHigh = qe._magnitude
 
 
+        def updateStatsColumns(self, cols):
+                if len(cols) == 0:
+                        return
+                tLow = fromEpoch(cols.time.min())
+                tHigh = fromEpoch(cols.time.max())
+                if tLow < self.timeLow: self.timeLow = tLow
+                if tHigh > self.timeHigh: self.timeHigh = tHigh
+                self.depthLow = min(self.depthLow, float(cols.depth.min()))
+                self.depthHigh = max(self.depthHigh, float(cols.depth.max()))
+                self.magLow = min(self.magLow, float(cols.mag.min()))
+                self.magHigh = max(self.magHigh, float(cols.mag.max()))
+
+
+        def Columns(self):
+                return self._cols
+
+
+        def snapshot(self):
+                # (columns, generation), read together
+                with self._queryLock:
+                        return self._cols, self.generation
+
+
         def QEntries(self):
-                return self._qentries
+                return QEntryView(self._cols)
 
 
         def queryCountry(self, strCountry):
-                query = []
-                for qentry in self._qentries:
-                        if strCountry in qentry._place:
-                                query.append(qentry)
-                return query
+                return QEntryView(self._cols, self._cols.placeRows(strCountry))
+
+
+        def queryByTime(self, dtLow, dtHigh):
+                lo, hi = self._cols.timeSlice(toEpoch(dtLow), toEpoch(dtHigh))
+                return QEntryView(self._cols, np.arange(lo, hi))
+
+
+        def queryByLocation(self, lat, lon, degRadius):
+                return QEntryView(self._cols, self._cols.withinCap(lat, lon, degRadius))
+
 
+        def queryByFilter(self, defFilter, cols=None):
+                # one read of the catalog: a refresh may swap it meanwhile.
+                # cols, e.g. from snapshot(), is queried instead when given
+                if cols is None:
+                        cols = self._cols
+                if hasattr(defFilter, "refines"):
+                        return QEntryView(cols, self._cachedIndices(defFilter, cols))
+                if hasattr(defFilter, "indices"):
+                        return QEntryView(cols, defFilter.indices(cols))
 
-        def queryByFilter(self, defFilter):
                 query = []
-                for qentry in self._qentries:
+                for idx, qentry in enumerate(QEntryView(cols)):
                         if defFilter.matches(qentry):
-                                query.append(qentry)
-                return query
+                                query.append(idx)
+                return QEntryView(cols, np.array(query, np.intp))
 
-        def initPlayback(self):
-                self._pos = len(self._qentries) - 1
-                self._date = self._qentries[self._pos]._time.date()
+        def _cachedIndices(self, defFilter, cols):
+                # an exact repeat is answered from the cache; a filter that
+                # refines a cached one only looks at that one's rows. Only
+                # entries computed on cols count
+                key = defFilter.key()
+                base = None
+                with self._queryLock:
+                        for entry in self._queryCache:
+                                if entry[3] is not cols:
+                                        continue
+                                if entry[0] == key:
+                                        self._queryCache.remove(entry)
+                                        self._queryCache.insert(0, entry)
+                                        return entry[2]
+                                if defFilter.refines(entry[1]):
+                                        if base is None or len(entry[2]) < len(base):
+                                                base = entry[2]
 
-        def getNextDay(self):
-                query = []
+                idx = defFilter.indices(cols, base)
 
-                while self._pos >= 0:
-                        qentry = self._qentries[self._pos]
+                with self._queryLock:
+                        if cols is self._cols:
+                                self._queryCache.insert(0, (key, defFilter, idx, cols))
+                                del self._queryCache[QDB.QUERY_CACHE:]
+                return idx
 
-                        if self._date == qentry._time.date():
-                                query.append(qentry)
-                                self._pos -= 1
-                        else:
-                                self._date = qentry._time.date()
-                                break
+        def buckets(self, unit="day"):
+                with self._queryLock:
+                        cols = self._cols
+                        buckets = self._buckets.get(unit)
+                if buckets is None:
+                        buckets = QTimeBuckets(cols, unit)
+                        with self._queryLock:
+                                if cols is self._cols:
+                                        self._buckets[unit] = buckets
+                return buckets
+
+
+        def bucketEntries(self, buckets, lo, hi=None):
+                # in the catalog the buckets were built from
+                start, stop = buckets.rows(lo, hi)
+                return QEntryView(buckets.cols, np.arange(start, stop))
+
+
+        def decluster(self):
+                # kept current over refreshes from then on
+                self._declustered = True
+                # on a copy, so readers of the current catalog never see
+                # one column set without the other; again if a refresh
+                # swapped the catalog meanwhile
+                while True:
+                        base = self._cols
+                        cols = copy.copy(base)
+                        cols.decluster()
+                        with self._queryLock:
+                                if self._cols is base:
+                                        self._cols = cols
+                                        self._buckets = {}
+                                        self._queryCache = []
+                                        self.generation += 1
+                                        return cols.cluster
 
-                return query
+        def declustered(self):
+                return self._declustered
 
 
+        def centroid(self, entries, weighted=False):
+                cols, idx = entries.Source()
+                return cols.centroid(idx, weighted)
+
+
+        def hotspot(self, entries, weighted=False, degRadius=10.0):
+                cols, idx = entries.Source()
+                return cols.hotspot(idx, weighted, degRadius)
+
+
+        def initPlayback(self):
+                self._pos = 0
+
+        def getNextDay(self):
+                # one precomputed bucket per UTC day, oldest first
+                if self._pos >= len(self._dayOffsets) - 1:
+                        return QEntryView(self._cols, np.zeros(0, np.intp))
 
+                lo = self._dayOffsets[self._pos]
+                hi = self._dayOffsets[self._pos + 1]
+                self._pos += 1
+                return QEntryView(self._cols, np.arange(lo, hi))
@@ -0,0 +1,414 @@
+import time
+import threading
+import traceback
+from collections import deque, OrderedDict
+
+
+################################################################################
+# Background rebuilds: a single worker thread with a latest-wins job slot.
+################################################################################
+
+class Cancelled(Exception):
+        # raised by RebuildTicket.check() once superseded
+        pass
+
+
+class RebuildTicket(object):
+        def __init__(self, scheduler, generation):
+                self._scheduler = scheduler
+                self.generation = generation
+
+        def cancelled(self):
+                return self._scheduler.latest() != self.generation
+
+        def check(self):
+                # call at chunk boundaries
+                if self.cancelled():
+                        raise Cancelled()
+
+
+class RebuildScheduler(object):
+        # jobs run one at a time on one worker; a newer submission replaces the
+        # waiting job and cancels the running one. Jobs are called as
+        # job(ticket, *args)
+
+        def __init__(self, onResult=None, name="RebuildScheduler"):
+                self._onResult = onResult
+                self._name = name
+                self._cv = threading.Condition()
+                self._slot = None
+                self._generation = 0
+                self._busy = False
+                self._stopped = False
+                self._thread = None
+
+                # counters
+                self.submitted = 0
+                self.dropped = 0
+                self.cancelled = 0
+                self.completed = 0
+
+        def submit(self, job, *args):
+                # returns the generation
+                with self._cv:
+                        self._generation += 1
+                        self.submitted += 1
+                        if self._slot is not None:
+                                self.dropped += 1
+                        self._slot = (self._generation, job, args)
+                        if self._thread is None:
+                                self._thread = threading.Thread(target=self._run, name=self._name)
+                                self._thread.daemon = True
+                                self._thread.start()
+                        self._cv.notify_all()
+                        return self._generation
+
+        def nextGeneration(self):
+                # for work done outside the scheduler; supersedes what is queued
+                with self._cv:
+                        self._generation += 1
+                        return self._generation
+
+        def latest(self):
+                return self._generation
+
+        def idle(self):
+                with self._cv:
+                        return self._slot is None and not self._busy
+
+        def waitIdle(self, timeout=None):
+                deadline = None
+                if timeout is not None:
+                        deadline = time.time() + timeout
+                with self._cv:
+                        while self._slot is not None or self._busy:
+                                if deadline is None:
+                                        self._cv.wait()
+                                        continue
+                                left = deadline - time.time()
+                                if left <= 0:
+                                        return False
+                                self._cv.wait(left)
+                        return True
+
+        def stop(self):
+                with self._cv:
+                        self._stopped = True
+                        self._slot = None
+                        self._cv.notify_all()
+
+        def _run(self):
+                while True:
+                        with self._cv:
+                                while self._slot is None and not self._stopped:
+                                        self._cv.wait()
+                                if self._stopped:
+                                        return
+                                generation, job, args = self._slot
+                                self._slot = None
+                                self._busy = True
+
+                        ticket = RebuildTicket(self, generation)
+                        try:
+                                ticket.check()
+                                result = job(ticket, *args)
+                                ticket.check()
+                                if self._onResult is not None:
+                                        self._onResult(generation, result)
+                                self.completed += 1
+                        except Cancelled:
+                                self.cancelled += 1
+                        except Exception:
+                                traceback.print_exc()
+
+                        with self._cv:
+                                self._busy = False
+                                self._cv.notify_all()
+
+
+################################################################################
+# Frame budgeted upload of finished meshes, driven from the frame loop.
+################################################################################
+
+class UploadStage(object):
+        # copies offered meshes into the renderer, a budget's worth per frame.
+        # begin(generation) -> target, upload(target, verts, colors, first),
+        # finish(target, generation) and rewrite(target, verts, colors, first)
+        # do the renderer work; only the newest mesh is kept. Uploads are
+        # sized from the measured cost per vertex to what is left of the
+        # budget, in whole units (e.g. the vertices of one primitive) and at
+        # most chunk vertices; at least one unit moves per frame
+
+        def __init__(self, begin, upload, finish, budget=0.004, chunk=4096, history=120,
+                     rewrite=None, unit=1):
+                self._begin = begin
+                self._upload = upload
+                self._finish = finish
+                self._rewrite = rewrite
+                self.budget = budget
+                self.chunk = chunk
+                self.unit = unit
+
+                # seconds per vertex uploaded or rewritten, 0 until measured
+                self.vertexCost = 0.0
+
+                self._lock = threading.Lock()
+                self._pending = None
+                self._current = None
+                self._target = None
+                self._done = 0
+                self._shown = 0
+
+                # target and vertex count of the mesh on screen
+                self._shownTarget = None
+                self._shownCount = 0
+
+                # (generation, verts, colors) to append once the mesh being
+                # uploaded is up
+                self._extensions = deque()
+
+                # (generation, first, verts, colors) waiting to be written
+                self._patches = deque()
+
+                # seconds spent in each of the last busy frames
+                self.frameTimes = deque(maxlen=history)
+                self.lastFrame = 0.0
+
+        def offer(self, generation, verts, colors):
+                # safe from any thread; older meshes are ignored
+                with self._lock:
+                        if generation <= self._newest():
+                                return False
+                        self._pending = (generation, verts, colors, False)
+                        self._extensions.clear()
+                        return True
+
+        def extend(self, generation, verts, colors):
+                # appends to the newest mesh, after it is up if it is still
+                # being uploaded; False without a mesh or when outdated
+                with self._lock:
+                        if generation <= self._newest():
+                                return False
+                        if self._pending is None and self._current is None:
+                                if self._shownTarget is None:
+                                        return False
+                                self._pending = (generation, verts, colors, True)
+                        else:
+                                self._extensions.append((generation, verts, colors))
+                        return True
+
+        def adopt(self, generation, target, count):
+                # shows a mesh uploaded before, of count vertices, in place of
+                # anything pending; extend() and patch() then write to target.
+                # Call from the thread that steps
+                with self._lock:
+                        if generation <= self._newest():
+                                return False
+                        self._pending = None
+                        self._current = None
+                        self._target = None
+                        self._extensions.clear()
+                        self._shown = generation
+                        self._shownTarget = target
+                        self._shownCount = count
+                        return True
+
+        def _newest(self):
+                newest = self._shown
+                if self._current is not None:
+                        newest = max(newest, self._current[0])
+                if self._pending is not None:
+                        newest = max(newest, self._pending[0])
+                if len(self._extensions) > 0:
+                        newest = max(newest, self._extensions[-1][0])
+                return newest
+
+        def patch(self, generation, first, verts, colors):
+                # written once that mesh is on screen, dropped once a newer one is
+                with self._lock:
+                        self._patches.append((generation, first, verts, colors))
+
+        def busy(self):
+                with self._lock:
+                        return self._pending is not None or self._current is not None or \
+                               len(self._extensions) > 0 or len(self._patches) > 0
+
+        def step(self):
+                # returns the seconds spent
+                start = time.time()
+                with self._lock:
+                        if self._pending is not None:
+                                self._current = self._pending
+                                self._pending = None
+                                self._target = None
+                                self._done = 0
+                        elif self._current is None and len(self._extensions) > 0:
+                                generation, verts, colors = self._extensions.popleft()
+                                self._current = (generation, verts, colors, True)
+                                self._done = 0
+                        current = self._current
+                        idle = current is None and len(self._patches) == 0
+
+                if idle:
+                        self.lastFrame = 0.0
+                        return 0.0
+
+                if current is not None:
+                        self._stepMesh(current, start)
+                if self._current is None:
+                        self._stepPatches(start)
+
+                self.lastFrame = time.time() - start
+                self.frameTimes.append(self.lastFrame)
+                return self.lastFrame
+
+        def _stepMesh(self, current, start):
+                generation, verts, colors, append = current
+                base = 0
+                if append:
+                        self._target = self._shownTarget
+                        base = self._shownCount
+                elif self._target is None:
+                        self._target = self._begin(generation)
+
+                count = len(verts)
+                moved = False
+                while self._done < count:
+                        now = time.time()
+                        if moved and now - start >= self.budget:
+                                break
+                        stop = min(count, self._done + self._fit(now - start))
+                        self._upload(self._target, verts[self._done:stop], colors[self._done:stop],
+                                     base + self._done)
+                        self._measure(stop - self._done, time.time() - now)
+                        self._done = stop
+                        moved = True
+
+                if self._done >= count:
+                        if not append:
+                                self._finish(self._target, generation)
+                        with self._lock:
+                                self._shown = generation
+                                self._shownTarget = self._target
+                                self._shownCount = base + count
+                                if self._current is current:
+                                        self._current = None
+                                self._target = None
+
+        def _stepPatches(self, start):
+                moved = False
+                while True:
+                        now = time.time()
+                        if moved and now - start >= self.budget:
+                                return
+                        with self._lock:
+                                if len(self._patches) == 0:
+                                        return
+                                generation, first, verts, colors = self._patches[0]
+                                if generation > self._shown:
+                                        # its mesh is not up yet
+                                        return
+                                self._patches.popleft()
+                                if generation < self._shown:
+                                        continue
+                                n = self._fit(now - start)
+                                if n < len(verts):
+                                        # the rest waits for the next go
+                                        self._patches.appendleft((generation, first + n, verts[n:], colors[n:]))
+                                        verts = verts[:n]
+                                        colors = colors[:n]
+                                target = self._shownTarget
+                        self._rewrite(target, verts, colors, first)
+                        self._measure(len(verts), time.time() - now)
+                        moved = True
+
+        def _fit(self, elapsed):
+                # vertices that fit in the rest of the budget
+                if self.vertexCost <= 0:
+                        n = self.unit
+                else:
+                        n = int((self.budget - elapsed) / self.vertexCost)
+                n = max(self.unit, n - n % self.unit)
+                return min(n, max(self.unit, self.chunk - self.chunk % self.unit))
+
+        def _measure(self, count, seconds):
+                if count <= 0:
+                        return
+                cost = seconds / count
+                if self.vertexCost <= 0:
+                        self.vertexCost = cost
+                else:
+                        self.vertexCost += (cost - self.vertexCost) * 0.25
+
+        def timings(self):
+                # (last, mean, max) seconds over recent busy frames
+                if len(self.frameTimes) == 0:
+                        return (self.lastFrame, 0.0, 0.0)
+                times = list(self.frameTimes)
+                return (self.lastFrame, sum(times) / len(times), max(times))
+
+
+################################################################################
+# Built meshes kept for reuse.
+################################################################################
+
+class GeomCache(object):
+        # thread safe LRU of built meshes under maxBytes. onEvict(value) is
+        # called, from whichever thread put or cleared, for every value
+        # dropped or not taken
+
+        def __init__(self, maxBytes=256 * 1024 * 1024, onEvict=None):
+                self.maxBytes = maxBytes
+                self._onEvict = onEvict
+                self._lock = threading.Lock()
+                self._entries = OrderedDict()
+                self._bytes = 0
+                self.hits = 0
+                self.misses = 0
+
+        def __len__(self):
+                return len(self._entries)
+
+        def bytes(self):
+                return self._bytes
+
+        def get(self, key):
+                with self._lock:
+                        entry = self._entries.pop(key, None)
+                        if entry is None:
+                                self.misses += 1
+                                return None
+                        self._entries[key] = entry
+                        self.hits += 1
+                        return entry[0]
+
+        def put(self, key, value, nbytes):
+                dropped = []
+                with self._lock:
+                        old = self._entries.pop(key, None)
+                        if old is not None:
+                                self._bytes -= old[1]
+                                if old[0] is not value:
+                                        dropped.append(old[0])
+                        if nbytes > self.maxBytes:
+                                dropped.append(value)
+                        else:
+                                self._entries[key] = (value, nbytes)
+                                self._bytes += nbytes
+                                while self._bytes > self.maxBytes:
+                                        oldKey, (oldValue, oldBytes) = self._entries.popitem(last=False)
+                                        self._bytes -= oldBytes
+                                        dropped.append(oldValue)
+                self._evicted(dropped)
+
+        def clear(self):
+                with self._lock:
+                        dropped = [value for value, nbytes in self._entries.values()]
+                        self._entries.clear()
+                        self._bytes = 0
+                self._evicted(dropped)
+
+        def _evicted(self, values):
+                if self._onEvict is not None:
+                        for value in values:
+                                self._onEvict(value)
@@ -10,7 +10,7 @@ version changelog: Fixed u() to just return the byte sequence on exception
 
 __version__ = "1.2.1"
 
-from struct import pack, unpack, calcsize, error
+from struct import pack, unpack, unpack_from, calcsize, error
 import os
 import sys
 import time
@@ -18,6 +18,16 @@ import array
 import tempfile
 import itertools
 
+# Optional: numpy gives zero-copy coordinate views in mmap mode
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
 #
 # Constants for shape types
 NULL = 0
@@ -187,6 +197,116 @@ class _Shape:
                     'coordinates': polys
                     }
 
+def _view(buf, offset, code, count, width=1):
+    """Returns count little endian values of type code ('d' or 'i') at
+    offset in buf without copying when possible: a numpy array (with
+    rows of width values when width > 1), a cast memoryview on Python 3
+    without numpy, and otherwise a flat _Array copy."""
+    if numpy is not None:
+        dtype = numpy.dtype({'d': '<f8', 'i': '<i4'}[code])
+        values = numpy.frombuffer(buf, dtype, count, offset)
+        if width > 1:
+            values = values.reshape(-1, width)
+        return values
+    if PYTHON3 and sys.byteorder == 'little':
+        size = calcsize("<" + code)
+        view = memoryview(buf)[offset:offset + count * size].cast('B')
+        if width > 1:
+            return view.cast(code, [count // width, width])
+        return view.cast(code)
+    return _decode(buf, offset, code, count)
+
+def _decode(buf, offset, code, count, byteorder='little'):
+    """Decodes count values of type code at offset in buf into an _Array
+    in one call. The values are little endian unless byteorder says
+    otherwise."""
+    values = _Array(code)
+    chunk = buf[offset:offset + count * calcsize("<" + code)]
+    if PYTHON3:
+        values.frombytes(chunk)
+    else:
+        values.fromstring(chunk)
+    if sys.byteorder != byteorder:
+        values.byteswap()
+    return values
+
+def _numberColumn(values, deci):
+    """Converts a numpy array of raw dbf numeric fields to int64, or to
+    float64 with NaN for blanks when the field has decimals or any value
+    is missing."""
+    values = numpy.char.replace(values, b('\0'), b(''))
+    values = numpy.char.replace(values, b('*'), b(''))  # QGIS NULL is all '*' chars
+    values = numpy.char.strip(values)
+    blank = values == b('')
+    if not deci and not blank.any():
+        return values.astype(numpy.int64)
+    return numpy.where(blank, b('nan'), values).astype(numpy.float64)
+
+def _dateColumn(values):
+    """Converts a numpy array of raw dbf YYYYMMDD fields to datetime64[D],
+    with NaT for blank, all '0' (QGIS NULL) and malformed values."""
+    values = numpy.char.strip(values)
+    valid = (numpy.char.str_len(values) == 8) & numpy.char.isdigit(values) & \
+            (values != b('00000000'))
+    dates = numpy.empty(len(values), 'datetime64[D]')
+    dates[:] = numpy.datetime64('NaT')
+    if valid.any():
+        n = values[valid].astype(numpy.int64)
+        years = (n // 10000 - 1970).astype('datetime64[Y]')
+        months = years.astype('datetime64[M]') + (n // 100 % 100 - 1)
+        dates[valid] = months.astype('datetime64[D]') + (n % 100 - 1)
+    return dates
+
+class _CoordShape(_Shape):
+    """A shape whose x, y pairs are held as one block in coords, either
+    flat or as rows of two. The points list is built on first use."""
+    def __init__(self, shapeType=None):
+        self.shapeType = shapeType
+        self.coords = []
+        self._points = None
+
+    @property
+    def points(self):
+        if self._points is None:
+            values = self.coords.tolist() if hasattr(self.coords, "tolist") else list(self.coords)
+            if values and not isinstance(values[0], list):
+                # a flat x, y, x, y... copy
+                values = [values[i:i + 2] for i in range(0, len(values), 2)]
+            self._points = [_Array('d', p) for p in values]
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        self._points = points
+
+class _ReadShape(_CoordShape):
+    """A shape decoded by Reader.__shape. coords is a flat _Array and
+    the m list, with nodata values as None, is built on first use."""
+    def __init__(self, shapeType=None):
+        _CoordShape.__init__(self, shapeType)
+        self._m = None
+        self._mList = None
+
+    @property
+    def m(self):
+        if self._mList is None:
+            if self._m is None:
+                raise AttributeError("m")
+            # Measure values less than -10e38 are nodata values according to the spec
+            self._mList = [m if m > -10e38 else None for m in self._m]
+        return self._mList
+
+    @m.setter
+    def m(self, m):
+        self._mList = m
+
+class _MappedShape(_CoordShape):
+    """A shape decoded from a memory mapped .shp file. Its coordinates
+    stay in the file's buffer: coords holds the x, y pairs as returned by
+    _view(), and parts, partTypes, z and m are views as well. Unlike the
+    regular reader, m values are not checked for nodata."""
+    pass
+
 class _ShapeRecord:
     """A shape object of any type."""
     def __init__(self, shape=None, record=None):
@@ -214,17 +334,25 @@ class Reader:
     within each file is only accessed when required and as
     efficiently as possible. Shapefiles are usually not large
     but they can be.
+
+    With mmap=True the .shp file is memory mapped (or read once
+    if it is not a real file) and shapes are _MappedShape objects
+    whose coordinates are views into it rather than copies.
     """
     def __init__(self, *args, **kwargs):
         self.shp = None
         self.shx = None
         self.dbf = None
+        self.mapped = kwargs.get("mmap", False)
+        self._shpBuffer = None
         self.shapeName = "Not specified"
-        self._offsets = []
+        self._index = None
+        self._offsets = None
         self.shpLength = None
         self.numRecords = None
         self.fields = []
         self.__dbfHdrLength = 0
+        self.__recFmt = None
         # See if a shapefile name was passed as an argument
         if len(args) > 0:
             if is_string(args[0]):
@@ -265,7 +393,8 @@ class Reader:
             try:
                 self.shx = open("%s.shx" % shapeName, "rb")
             except IOError:
-                raise ShapefileException("Unable to open %s.shx" % shapeName)
+                # The index is rebuilt from the .shp when needed
+                self.shx = None
             try:
                 self.dbf = open("%s.dbf" % shapeName, "rb")
             except IOError:
@@ -317,82 +446,235 @@ class Reader:
     def __shape(self):
         """Returns the header info and geometry for a single shape."""
         f = self.__getFileObj(self.shp)
-        record = _Shape()
-        nParts = nPoints = zmin = zmax = mmin = mmax = None
+        nParts = nPoints = 0
         (recNum, recLength) = unpack(">2i", f.read(8))
-        # Determine the start of the next record
-        next = f.tell() + (2 * recLength)
-        shapeType = unpack("<i", f.read(4))[0]
-        record.shapeType = shapeType
-        # For Null shapes create an empty points list for consistency
-        if shapeType == 0:
-            record.points = []
+        # The whole record is read at once and decoded from memory
+        content = f.read(2 * recLength)
+        shapeType = unpack_from("<i", content)[0]
+        pos = 4
+        record = _ReadShape(shapeType)
         # All shape types capable of having a bounding box
-        elif shapeType in (3,5,8,13,15,18,23,25,28,31):
-            record.bbox = _Array('d', unpack("<4d", f.read(32)))
+        if shapeType in (3,5,8,13,15,18,23,25,28,31):
+            record.bbox = _decode(content, pos, 'd', 4)
+            pos += 32
         # Shape types with parts
         if shapeType in (3,5,13,15,23,25,31):
-            nParts = unpack("<i", f.read(4))[0]
+            nParts = unpack_from("<i", content, pos)[0]
+            pos += 4
         # Shape types with points
-        if shapeType in (3,5,8,13,15,23,25,31):
-            nPoints = unpack("<i", f.read(4))[0]
+        if shapeType in (3,5,8,13,15,18,23,25,28,31):
+            nPoints = unpack_from("<i", content, pos)[0]
+            pos += 4
         # Read parts
         if nParts:
-            record.parts = _Array('i', unpack("<%si" % nParts, f.read(nParts * 4)))
+            record.parts = _decode(content, pos, 'i', nParts)
+            pos += nParts * 4
         # Read part types for Multipatch - 31
         if shapeType == 31:
-            record.partTypes = _Array('i', unpack("<%si" % nParts, f.read(nParts * 4)))
-        # Read points - produces a list of [x,y] values
+            record.partTypes = _decode(content, pos, 'i', nParts)
+            pos += nParts * 4
+        # Read points - x,y pairs in one flat array
         if nPoints:
-            record.points = [_Array('d', unpack("<2d", f.read(16))) for p in range(nPoints)]
-        # Read z extremes and values
+            record.coords = _decode(content, pos, 'd', nPoints * 2)
+            pos += nPoints * 16
+        # Read z values, skipping the extremes
         if shapeType in (13,15,18,31):
-            (zmin, zmax) = unpack("<2d", f.read(16))
-            record.z = _Array('d', unpack("<%sd" % nPoints, f.read(nPoints * 8)))
-        # Read m extremes and values if header m values do not equal 0.0
+            pos += 16
+            record.z = _decode(content, pos, 'd', nPoints)
+            pos += nPoints * 8
+        # Read m values if header m values do not equal 0.0
         if shapeType in (13,15,18,23,25,28,31) and not 0.0 in self.measure:
-            (mmin, mmax) = unpack("<2d", f.read(16))
-            # Measure values less than -10e38 are nodata values according to the spec
-            record.m = []
-            for m in _Array('d', unpack("<%sd" % nPoints, f.read(nPoints * 8))):
-                if m > -10e38:
-                    record.m.append(m)
-                else:
-                    record.m.append(None)
+            pos += 16
+            record._m = _decode(content, pos, 'd', nPoints)
+            pos += nPoints * 8
         # Read a single point
         if shapeType in (1,11,21):
-            record.points = [_Array('d', unpack("<2d", f.read(16)))]
+            record.coords = _decode(content, pos, 'd', 2)
+            pos += 16
         # Read a single Z value
         if shapeType == 11:
-            record.z = unpack("<d", f.read(8))
+            record.z = unpack_from("<d", content, pos)
+            pos += 8
         # Read a single M value
         if shapeType in (11,21):
-            record.m = unpack("<d", f.read(8))
-        # Seek to the end of this record as defined by the record header because
-        # the shapefile spec doesn't require the actual content to meet the header
-        # definition.  Probably allowed for lazy feature deletion. 
-        f.seek(next)
+            record._mList = unpack_from("<d", content, pos)
+        # Content beyond what the shape type defines is skipped: the shapefile
+        # spec doesn't require the actual content to meet the header
+        # definition.  Probably allowed for lazy feature deletion.
         return record
 
+    def __mapShp(self):
+        """Returns the .shp contents as a buffer, mapping the file the
+        first time."""
+        if self._shpBuffer is None:
+            shp = self.__getFileObj(self.shp)
+            try:
+                self._shpBuffer = mmap.mmap(shp.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, ValueError, EnvironmentError):
+                # no mmap module, not a real file or an empty one
+                shp.seek(0)
+                self._shpBuffer = shp.read()
+        return self._shpBuffer
+
+    def __mappedShape(self, pos):
+        """Decodes the record at byte pos of the mapped .shp. Returns the
+        shape and the position of the next record."""
+        buf = self.__mapShp()
+        (recNum, recLength) = unpack_from(">2i", buf, pos)
+        # Determine the start of the next record
+        next = pos + 8 + (2 * recLength)
+        pos += 8
+        shapeType = unpack_from("<i", buf, pos)[0]
+        pos += 4
+        record = _MappedShape(shapeType)
+        nParts = nPoints = 0
+        # All shape types capable of having a bounding box
+        if shapeType in (3,5,8,13,15,18,23,25,28,31):
+            record.bbox = _Array('d', unpack_from("<4d", buf, pos))
+            pos += 32
+        # Shape types with parts
+        if shapeType in (3,5,13,15,23,25,31):
+            nParts = unpack_from("<i", buf, pos)[0]
+            pos += 4
+        # Shape types with points
+        if shapeType in (3,5,8,13,15,18,23,25,28,31):
+            nPoints = unpack_from("<i", buf, pos)[0]
+            pos += 4
+        if nParts:
+            record.parts = _view(buf, pos, 'i', nParts)
+            pos += nParts * 4
+        # Part types for Multipatch - 31
+        if shapeType == 31:
+            record.partTypes = _view(buf, pos, 'i', nParts)
+            pos += nParts * 4
+        if nPoints:
+            record.coords = _view(buf, pos, 'd', nPoints * 2, 2)
+            pos += nPoints * 16
+        # z extremes and values
+        if shapeType in (13,15,18,31):
+            pos += 16
+            record.z = _view(buf, pos, 'd', nPoints)
+            pos += nPoints * 8
+        # m extremes and values if header m values do not equal 0.0
+        if shapeType in (13,15,18,23,25,28,31) and not 0.0 in self.measure:
+            pos += 16
+            record.m = _view(buf, pos, 'd', nPoints)
+            pos += nPoints * 8
+        # A single point
+        if shapeType in (1,11,21):
+            record.coords = _view(buf, pos, 'd', 2, 2)
+            pos += 16
+        if shapeType == 11:
+            record.z = unpack_from("<d", buf, pos)
+            pos += 8
+        if shapeType in (11,21):
+            record.m = unpack_from("<d", buf, pos)
+        return record, next
+
+    def __iterMapped(self):
+        """Yields the shapes of the mapped .shp in order."""
+        buf = self.__mapShp()
+        self.shpLength = len(buf)
+        pos = 100
+        while pos < self.shpLength:
+            record, pos = self.__mappedShape(pos)
+            yield record
+
     def __shapeIndex(self, i=None):
         """Returns the offset in a .shp file for a shape based on information
         in the .shx index file."""
+        index = self.shapeIndex()
+        if index is None:
+            return None
+        if self._offsets is None:
+            if numpy is not None:
+                self._offsets = index[:,0]
+            else:
+                self._offsets = index[0::2]
+        if not i == None:
+            return int(self._offsets[i])
+
+    def shapeIndex(self):
+        """Returns the offset and content length in bytes of every record
+        in the .shp file, as found in the .shx index: an (n, 2) int64
+        array with numpy, otherwise a flat _Array of offset, length pairs.
+        Offsets point at the 8 byte record headers. The index is read and
+        decoded in one go on first use. Without a .shx file it is rebuilt
+        by scanning the record headers of the .shp; see saveShx()."""
         shx = self.shx
         if not shx:
-            return None
-        if not self._offsets:
+            if not self.shp:
+                return None
+            if self._index is None:
+                pairs = self.__scanShp()
+                if numpy is not None:
+                    self._index = numpy.array(pairs, numpy.int64).reshape(-1, 2)
+                else:
+                    self._index = _Array('l', pairs)
+            return self._index
+        if self._index is None:
             # File length (16-bit word * 2 = bytes) - header length
             shx.seek(24)
             shxRecordLength = (unpack(">i", shx.read(4))[0] * 2) - 100
             numRecords = shxRecordLength // 8
             # Jump to the first record.
             shx.seek(100)
-            for r in range(numRecords):
-                # Offsets are 16-bit words just like the file length
-                self._offsets.append(unpack(">i", shx.read(4))[0] * 2)
-                shx.seek(shx.tell() + 4)
-        if not i == None:
-            return self._offsets[i]
+            data = shx.read(numRecords * 8)
+            numRecords = len(data) // 8
+            # Offsets and lengths are big endian 16-bit word counts
+            if numpy is not None:
+                words = numpy.frombuffer(data, '>i4', numRecords * 2)
+                self._index = words.reshape(-1, 2).astype(numpy.int64) * 2
+            else:
+                words = _decode(data, 0, 'i', numRecords * 2, 'big')
+                self._index = _Array('l', [w * 2 for w in words])
+        return self._index
+
+    def __scanShp(self):
+        """Returns the offset, content length pairs of the .shp records as
+        a flat list, reading only the 8 byte record headers."""
+        shp = self.__getFileObj(self.shp)
+        shp.seek(0,2)
+        shpLength = shp.tell()
+        pairs = []
+        pos = 100
+        while pos + 8 <= shpLength:
+            shp.seek(pos)
+            (recNum, recLength) = unpack(">2i", shp.read(8))
+            pairs.append(pos)
+            pairs.append(2 * recLength)
+            pos += 8 + 2 * recLength
+        return pairs
+
+    def saveShx(self, target=None):
+        """Writes the index returned by shapeIndex() as a .shx file to
+        target, a file name or file-like object, or next to the .shp
+        when the shapefile was opened by name. Meant for shapefiles that
+        came without one."""
+        index = self.shapeIndex()
+        if index is None:
+            raise ShapefileException("Shapefile Reader requires a shapefile or file-like object. (no shp file found")
+        if hasattr(index, "ravel"):
+            index = index.ravel()
+        words = [int(v) // 2 for v in index]
+        # Same header as the .shp apart from the file length
+        shp = self.__getFileObj(self.shp)
+        shp.seek(0)
+        header = shp.read(100)
+        data = header[:24] + pack(">i", 50 + len(words) * 2) + header[28:] + \
+               pack(">%si" % len(words), *words)
+        if target is None:
+            if self.shapeName == "Not specified":
+                raise ShapefileException("No file name given for the .shx file.")
+            target = "%s.shx" % self.shapeName
+        if is_string(target):
+            f = open(target, "wb")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+        else:
+            target.write(data)
 
     def shape(self, i=0):
         """Returns a shape object for a shape in the the geometry
@@ -405,12 +687,16 @@ class Reader:
             for j,k in enumerate(self.iterShapes()):
                 if j == i:
                     return k
+        if self.mapped:
+            return self.__mappedShape(offset)[0]
         shp.seek(offset)
         return self.__shape()
 
     def shapes(self):
         """Returns all shapes in a shapefile."""
         shp = self.__getFileObj(self.shp)
+        if self.mapped:
+            return list(self.__iterMapped())
         # Found shapefiles which report incorrect
         # shp file length in the header. Can't trust
         # that so we seek to the end of the file
@@ -427,6 +713,10 @@ class Reader:
         """Serves up shapes in a shapefile as an iterator. Useful
         for handling large shapefiles."""
         shp = self.__getFileObj(self.shp)
+        if self.mapped:
+            for record in self.__iterMapped():
+                yield record
+            return
         shp.seek(0,2)
         self.shpLength = shp.tell()
         shp.seek(100)
@@ -467,14 +757,18 @@ class Reader:
         if terminator != b("\r"):
             raise ShapefileException("Shapefile dbf header lacks expected terminator. (likely corrupt?)")
         self.fields.insert(0, ('DeletionFlag', 'C', 1, 0))
+        self.__recFmt = None
 
     def __recordFmt(self):
-        """Calculates the size of a .shp geometry record."""
+        """Calculates the size of a .dbf record. The layout is worked out
+        once per header and reused."""
         if not self.numRecords:
             self.__dbfHeader()
-        fmt = ''.join(['%ds' % fieldinfo[2] for fieldinfo in self.fields])
-        fmtSize = calcsize(fmt)
-        return (fmt, fmtSize)
+        if self.__recFmt is None:
+            fmt = ''.join(['%ds' % fieldinfo[2] for fieldinfo in self.fields])
+            fmtSize = calcsize(fmt)
+            self.__recFmt = (fmt, fmtSize)
+        return self.__recFmt
 
     def __record(self):
         """Reads and returns a dbf record row as a list of values."""
@@ -485,40 +779,43 @@ class Reader:
             # deleted record
             return None
         record = []
-        for (name, typ, size, deci), value in zip(self.fields,
-                                                                                                recordContents):
-            if name == 'DeletionFlag':
-                continue
-            elif not value.strip():
-                record.append(value)
+        for field, value in zip(self.fields, recordContents):
+            if field[0] == 'DeletionFlag':
                 continue
-            elif typ == "N":
-                value = value.replace(b('\0'), b('')).strip()
-                value = value.replace(b('*'), b(''))  # QGIS NULL is all '*' chars
-                if value == b(''):
-                    value = None
-                elif deci:
-                    value = float(value)
-                else:
-                    value = int(value)
-            elif typ == b('D'):
-                if value.count(b('0')) == len(value):  # QGIS NULL is all '0' chars
-                    value = None
-                else:
-                    try:
-                        y, m, d = int(value[:4]), int(value[4:6]), int(value[6:8])
-                        value = [y, m, d]
-                    except:
-                        value = value.strip()
-            elif typ == b('L'):
-                value = (value in b('YyTt') and b('T')) or \
-                                        (value in b('NnFf') and b('F')) or b('?')
-            else:
-                value = u(value)
-                value = value.strip()
-            record.append(value)
+            record.append(self.__value(field, value))
         return record
 
+    def __value(self, field, value):
+        """Converts the raw bytes of one dbf field to its Python value."""
+        (name, typ, size, deci) = field
+        if not value.strip():
+            return value
+        elif typ == "N":
+            value = value.replace(b('\0'), b('')).strip()
+            value = value.replace(b('*'), b(''))  # QGIS NULL is all '*' chars
+            if value == b(''):
+                value = None
+            elif deci:
+                value = float(value)
+            else:
+                value = int(value)
+        elif typ == b('D'):
+            if value.count(b('0')) == len(value):  # QGIS NULL is all '0' chars
+                value = None
+            else:
+                try:
+                    y, m, d = int(value[:4]), int(value[4:6]), int(value[6:8])
+                    value = [y, m, d]
+                except:
+                    value = value.strip()
+        elif typ == b('L'):
+            value = (value in b('YyTt') and b('T')) or \
+                                    (value in b('NnFf') and b('F')) or b('?')
+        else:
+            value = u(value)
+            value = value.strip()
+        return value
+
     def record(self, i=0):
         """Returns a specific dbf record based on the supplied index."""
         f = self.__getFileObj(self.dbf)
@@ -555,6 +852,76 @@ class Reader:
             if r:
                 yield r
 
+    def columns(self, fields=None, blockRows=65536):
+        """Returns a dict of field name to column of values for the
+        fields named (all of them by default), leaving deleted records
+        out. Only the named fields are decoded. With numpy the dbf is read
+        blockRows records at a time and numeric fields become int64 or
+        float64 arrays (see _numberColumn), dates datetime64[D] arrays and
+        the rest lists of the values records() gives. Without numpy every
+        column is a list of those values."""
+        if not self.numRecords:
+            self.__dbfHeader()
+        f = self.__getFileObj(self.dbf)
+        recFmt = self.__recordFmt()
+        names = [field[0] for field in self.fields]
+        if fields is not None:
+            missing = [name for name in fields if name not in names]
+            if missing:
+                raise ShapefileException("No such dbf fields: %s" % ", ".join(missing))
+        # (field, byte offset in the record, position in the record format)
+        offset = 0
+        layout = []
+        for i, field in enumerate(self.fields):
+            if i > 0 and (fields is None or field[0] in fields):
+                layout.append((field, offset, i))
+            offset += field[2]
+        f.seek(self.__dbfHeaderLength())
+        if numpy is None:
+            columns = dict((field[0], []) for field, offset, i in layout)
+            for r in xrange(self.numRecords):
+                recordContents = unpack(recFmt[0], f.read(recFmt[1]))
+                if recordContents[0] != b(' '):
+                    continue
+                for field, offset, i in layout:
+                    columns[field[0]].append(self.__value(field, recordContents[i]))
+            return columns
+        dtype = numpy.dtype({'names': ['DeletionFlag'] + [field[0] for field, offset, i in layout],
+                             'formats': ['S1'] + ['S%d' % field[2] for field, offset, i in layout],
+                             'offsets': [0] + [offset for field, offset, i in layout],
+                             'itemsize': recFmt[1]})
+        blocks = dict((field[0], []) for field, offset, i in layout)
+        left = self.numRecords
+        while left > 0:
+            rows = min(left, blockRows)
+            data = f.read(rows * recFmt[1])
+            rows = len(data) // recFmt[1]
+            if rows == 0:
+                break
+            left -= rows
+            block = numpy.frombuffer(data, dtype, rows)
+            block = block[block['DeletionFlag'] == b(' ')]
+            for (name, typ, size, deci), offset, i in layout:
+                values = block[name]
+                if typ in ("N", "F"):
+                    values = _numberColumn(values, deci)
+                elif typ == "D":
+                    values = _dateColumn(values)
+                else:
+                    values = [self.__value((name, typ, size, deci), v) for v in values.tolist()]
+                blocks[name].append(values)
+        columns = {}
+        for (name, typ, size, deci), offset, i in layout:
+            parts = blocks[name]
+            if typ in ("N", "F", "D"):
+                if parts:
+                    columns[name] = numpy.concatenate(parts)
+                else:
+                    columns[name] = numpy.empty(0, typ == "D" and 'datetime64[D]' or numpy.int64)
+            else:
+                columns[name] = list(itertools.chain(*parts))
+        return columns
+
     def shapeRecord(self, i=0):
         """Returns a combination geometry and attribute record for the
         supplied record index."""
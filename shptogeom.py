@@ -29,22 +29,22 @@ class ShapeToGeom:
         def __init__(self, pathToShpRec, pathToShp):
                 
                 self._sf = shapefile.Reader(pathToShpRec)
-                self._sf2 = shapefile.Reader(pathToShp)
-                self._shpRecs = self._sf.shapeRecords()
+                self._sf2 = shapefile.Reader(pathToShp, mmap=True)
+                # only the label positions are needed from the attributes
+                self._recs = self._sf.columns(["LAT", "LON", "NAME"])
 
                 shps = self._sf2.shapes()
                 shps.reverse()
                 print(self._sf2.bbox)
                 self._lstBorders = []
 
-                for idx, sr in enumerate(self._shpRecs):
+                for idx in range(len(self._recs["NAME"])):
 
                         # indent
                         shp = shps[idx]
-                        rec = sr.record
 
-                        lat = rec[ShapeToGeom._LAT]
-                        lon = rec[ShapeToGeom._LON]
+                        lat = float(self._recs["LAT"][idx])
+                        lon = float(self._recs["LON"][idx])
                         origin = ShapeToGeom._sphToEuc(lat, lon)
 
                         lstPoints = ShapeToGeom._shapeToPoints(shp, origin)
@@ -80,7 +80,18 @@ class ShapeToGeom:
 
                 lstPoints = []
 
-                for point in shape.points:
+                # read shapes keep their coordinates in one block, either
+                # flat x, y, x, y... or as rows of two; points is only built
+                # for shapes without one
+                coords = getattr(shape, "coords", None)
+                if coords is not None and len(coords):
+                        points = coords.tolist() if hasattr(coords, "tolist") else list(coords)
+                        if not isinstance(points[0], list):
+                                points = zip(points[0::2], points[1::2])
+                else:
+                        points = shape.points
+
+                for point in points:
 
                         v3d = ShapeToGeom._sphToEuc(point[1], point[0])
                         lstPoints.append(v3d)
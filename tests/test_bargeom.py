@@ -0,0 +1,155 @@
+import unittest
+import numpy as np
+
+from math import *
+from euclid import *
+from qtest import QColumns
+from bargeom import *
+
+
+def columns(lat, lon, depth, mag):
+        cols = QColumns()
+        cols.time = np.arange(len(lat), dtype=np.int64)
+        cols.lat = np.array(lat, np.float64)
+        cols.lon = np.array(lon, np.float64)
+        cols.x, cols.y, cols.z = QColumns.sphToEuc(cols.lat, cols.lon)
+        cols.depth = np.array(depth, np.float64)
+        cols.mag = np.array(mag, np.float64)
+        return cols
+
+
+class TestBarGeometry(unittest.TestCase):
+
+        def setUp(self):
+                rnd = np.random.RandomState(7)
+                n = 50
+                self.cols = columns(rnd.uniform(-89, 89, n), rnd.uniform(-180, 180, n),
+                                    rnd.uniform(0, 0.1, n), rnd.uniform(6, 9, n))
+
+        def test_orientations_match_euclid(self):
+                cols = self.cols
+                frames = quatFrames(barOrientations(cols.x, cols.y, cols.z))
+                n = Vector3(0, 1, 0)
+                for i in range(len(cols)):
+                        p = Vector3(cols.x[i], cols.y[i], cols.z[i]).normalized()
+                        m = Matrix4()
+                        m.rotate_axis(acos(p.dot(n)), n.cross(p))
+                        for corner in ((1, 0, 0), (0, 1, 0), (0, 0, 1)):
+                                v = m.transform(Vector3(*corner))
+                                np.testing.assert_allclose(frames[i].dot(corner), (v.x, v.y, v.z),
+                                                           atol=1e-9)
+
+        def test_poles(self):
+                frames = quatFrames(barOrientations(np.array([0.0, 0.0]), np.array([1.0, -1.0]),
+                                                    np.array([0.0, 0.0])))
+                np.testing.assert_allclose(frames[0].dot((0, 1, 0)), (0, 1, 0), atol=1e-12)
+                np.testing.assert_allclose(frames[1].dot((0, 1, 0)), (0, -1, 0), atol=1e-12)
+
+        def test_expand_matches_old_strips(self):
+                # the per event Matrix4 path the bars were built with before
+                cols = self.cols
+                scale = 3.0
+                t = 0.005
+                verts, colors = barMesh(cols, scale, False, 6, 9, (1, 0, 0), (0, 1, 0), t)
+                self.assertEqual(verts.shape, (len(cols) * BAR_VERTICES, 3))
+                self.assertEqual(colors.shape, (len(cols) * BAR_VERTICES, 4))
+
+                n = Vector3(0, 1, 0)
+                for i in range(len(cols)):
+                        p = Vector3(cols.x[i], cols.y[i], cols.z[i]).normalized()
+                        m = Matrix4()
+                        m.translate(p.x, p.y, p.z)
+                        m.rotate_axis(acos(p.dot(n)), n.cross(p))
+                        m.scale(1, cols.depth[i] * scale, 1)
+                        old = []
+                        for k in STRIP:
+                                c = _corner(k, t)
+                                v = m.transform(Vector3(*c))
+                                old.append((v.x, v.y, v.z))
+                        strip = verts[i * BAR_VERTICES:(i + 1) * BAR_VERTICES]
+                        np.testing.assert_allclose(strip, old, atol=1e-6)
+
+                        tm = (cols.mag[i] - 6) / 3.0
+                        np.testing.assert_allclose(colors[i * BAR_VERTICES], (tm, 1 - tm, 0, 1),
+                                                   atol=1e-6)
+
+        def test_scale_and_quantity(self):
+                inst = BarInstances(self.cols, False, 6, 9, (1, 0, 0), (0, 1, 0))
+                self.assertTrue(inst.withQuantity(False) is inst)
+                byMag = inst.withQuantity(True)
+                np.testing.assert_allclose(byMag.buffer[:, BarInstances.HEIGHT], self.cols.mag,
+                                           rtol=1e-6)
+                np.testing.assert_allclose(inst.buffer[:, BarInstances.HEIGHT], self.cols.depth,
+                                           rtol=1e-6)
+
+                # a scale change is the same as bars twice as deep
+                deeper = columns(self.cols.lat, self.cols.lon, self.cols.depth * 2, self.cols.mag)
+                twice = BarInstances(deeper, False, 6, 9, (1, 0, 0), (0, 1, 0)).expand(1.0)[0]
+                np.testing.assert_allclose(inst.expand(2.0)[0], twice, atol=1e-6)
+                np.testing.assert_array_equal(inst.expand(2.0, 10, 20)[0],
+                                              inst.expand(2.0)[0][10 * BAR_VERTICES:20 * BAR_VERTICES])
+
+
+def _corner(k, t):
+        x, y, z = [(-t, 0, t), (-t, 1, t), (t, 0, t), (t, 1, t),
+                   (t, 0, -t), (t, 1, -t), (-t, 0, -t), (-t, 1, -t)][k]
+        return x, y, z
+
+
+class TestBarRing(unittest.TestCase):
+
+        def setUp(self):
+                rnd = np.random.RandomState(3)
+                n = 40
+                self.cols = columns(rnd.uniform(-60, 60, n), rnd.uniform(-180, 180, n),
+                                    rnd.uniform(0, 0.1, n), rnd.uniform(6, 9, n))
+                self.inst = BarInstances(self.cols, False, 6, 9, (1, 0, 0), (0, 1, 0))
+
+        def apply(self, mirror, patches):
+                verts, colors = mirror
+                for first, v, c in patches:
+                        verts[first:first + len(v)] = v
+                        colors[first:first + len(c)] = c
+
+        def test_patches_rebuild_the_mesh(self):
+                ring = BarRing(16, 5.0, levels=4)
+                mirror = ring.mesh()
+                day = 0
+                for start in range(0, 40, 4):
+                        inst = BarInstances(self.cols.take(slice(start, start + 4)), False, 6, 9,
+                                            (1, 0, 0), (0, 1, 0))
+                        times = np.full(4, day, np.float64)
+                        self.apply(mirror, ring.advance(day))
+                        self.apply(mirror, ring.push(inst, times, 1.0))
+                        verts, colors = ring.mesh()
+                        np.testing.assert_array_equal(mirror[0], verts)
+                        np.testing.assert_array_equal(mirror[1], colors)
+                        day += 1
+                # four days of four bars are within the window
+                self.assertEqual(len(ring), 16)
+
+        def test_expire_and_fade(self):
+                ring = BarRing(8, 4.0, levels=4, dim=0.2)
+                inst = BarInstances(self.cols.take(slice(0, 4)), False, 6, 9, (1, 0, 0), (0, 1, 0))
+                ring.push(inst, np.zeros(4), 1.0, now=0)
+                base = ring.colors[0].copy()
+                ring.advance(3.5)
+                np.testing.assert_allclose(ring.colors[0], base * 0.2, rtol=1e-6)
+                ring.advance(4.5)
+                self.assertEqual(len(ring), 0)
+                self.assertFalse(ring.verts.any())
+
+        def test_overflow_keeps_newest(self):
+                ring = BarRing(8, 100.0)
+                ring.push(self.inst, np.arange(40, dtype=np.float64), 1.0)
+                self.assertEqual(len(ring), 8)
+                verts, colors = self.inst.expand(1.0, 32)
+                # the newest eight bars, wrapped around the slots
+                slots = np.arange(32, 40) % 8
+                for k, slot in enumerate(slots):
+                        np.testing.assert_array_equal(ring.verts[slot * BAR_VERTICES:(slot + 1) * BAR_VERTICES],
+                                                      verts[k * BAR_VERTICES:(k + 1) * BAR_VERTICES])
+
+
+if __name__ == "__main__":
+        unittest.main()
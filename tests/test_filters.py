@@ -0,0 +1,71 @@
+import os
+import datetime
+import unittest
+import numpy as np
+
+from euclid import *
+from qtest import *
+from filters import *
+
+CATALOG = os.path.join(os.path.dirname(__file__), "..", "data", "query1950.csv")
+
+
+class TestFilterMasks(unittest.TestCase):
+
+        @classmethod
+        def setUpClass(cls):
+                cls.qdb = QDB(CATALOG)
+                cls.qdb.Parse(useCache=False)
+                cls.cols = cls.qdb.Columns()
+                cls.qdb.decluster()
+                cls.declustered = cls.qdb.Columns()
+
+        def check(self, filter, cols=None):
+                # the batch evaluation agrees with matches() row by row
+                if cols is None:
+                        cols = self.cols
+                scalar = np.array([bool(filter.matches(cols.entry(i))) for i in range(len(cols))])
+                np.testing.assert_array_equal(filter.mask(cols), scalar)
+                np.testing.assert_array_equal(filter.indices(cols), np.flatnonzero(scalar))
+
+                idx = np.arange(0, len(cols), 3)
+                np.testing.assert_array_equal(filter.mask(cols, idx), scalar[idx])
+                np.testing.assert_array_equal(filter.indices(cols, idx), idx[scalar[idx]])
+                return scalar.sum()
+
+        def test_single(self):
+                self.assertTrue(self.check(DefTimeFilter(datetime.datetime(1990, 1, 1),
+                                                         datetime.datetime(2000, 12, 31))) > 0)
+                self.assertTrue(self.check(DefLocationFilter("Japan", Vector2(36, 138), 10)) > 0)
+                self.assertTrue(self.check(DefMagnitudeFilter(7, 8)) > 0)
+                self.assertTrue(self.check(DefAttributeFilter(magTypes=["mw", "mww"])) > 0)
+                self.assertTrue(self.check(DefAttributeFilter(place="Chile")) > 0)
+                self.assertEqual(self.check(DefPassFilter()), len(self.cols))
+
+        def test_composite(self):
+                filter = DefCompositeFilter(DefLocationFilter("Chile", Vector2(-30, -71), 20),
+                                            DefTimeFilter(datetime.datetime(1960, 1, 1),
+                                                          datetime.datetime(2010, 12, 31)),
+                                            DefMagnitudeFilter(6, 8),
+                                            DefAttributeFilter(types=["earthquake"]))
+                self.assertTrue(self.check(filter) > 0)
+
+        def test_cluster(self):
+                self.check(DefClusterFilter(), self.declustered)
+                self.check(DefClusterFilter(False, int(self.declustered.cluster[0])), self.declustered)
+                # everything passes before declustering
+                self.assertEqual(self.check(DefClusterFilter()), len(self.cols))
+
+        def test_query_cache(self):
+                # a refining filter answered from a cached result is the same
+                wide = DefCompositeFilter(DefPassFilter(), DefTimeFilter(datetime.datetime(1980, 1, 1),
+                                                                         datetime.datetime(2010, 12, 31)))
+                narrow = wide.replace(DefCompositeFilter.MAGNITUDE, DefMagnitudeFilter(7, 9))
+                self.assertTrue(narrow.refines(wide))
+                self.qdb.queryByFilter(wide)
+                np.testing.assert_array_equal(self.qdb.queryByFilter(narrow).Indices(),
+                                              narrow.indices(self.qdb.Columns()))
+
+
+if __name__ == "__main__":
+        unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from qtest import *
+
+
+def columns(times, ids, updated):
+        cols = QColumns()
+        n = len(times)
+        for name in QColumns.names():
+                setattr(cols, name, np.zeros(n, getattr(cols, name).dtype))
+        cols.time = np.array(times, np.int64)
+        cols.id = np.array(ids, "S")
+        cols.updated = np.array(updated, np.int64)
+        cols.place = np.array(["p%d" % t for t in times], "S")
+        return cols
+
+
+class TestMerge(unittest.TestCase):
+
+        def test_order_and_duplicates(self):
+                a = columns([1, 3, 5, 7], ["a", "b", "c", "d"], [0, 0, 5, 0])
+                b = columns([2, 3, 6], ["e", "b", "c"], [0, 0, 1])
+                c = columns([4, 8], ["f", "d"], [0, 1])
+                cols, rowMaps = QColumns.Merge([a, b, c], withRows=True)
+
+                # b's "b" wins the tie, a's "c" is newer, c's "d" is newer
+                self.assertEqual(list(cols.time), [1, 2, 3, 4, 5, 8])
+                self.assertEqual(list(cols.id), ["a", "e", "b", "f", "c", "d"])
+                self.assertTrue(cols.sorted and cols.unique)
+                self.assertEqual(list(rowMaps[0]), [0, -1, 4, -1])
+                self.assertEqual(list(rowMaps[1]), [1, 2, -1])
+                self.assertEqual(list(rowMaps[2]), [3, 5])
+
+        def test_within_one_input(self):
+                # the later row wins among equally updated ones
+                a = columns([1, 2, 3], ["x", "y", "x"], [0, 0, 0])
+                cols = QColumns.Merge([a])
+                self.assertEqual(list(cols.place), ["p2", "p3"])
+
+        def test_onto_merged(self):
+                base = QColumns.Merge([columns([1, 2, 3], ["a", "b", "c"], [0, 0, 0])])
+                more = columns([2, 4], ["b", "d"], [1, 0])
+                cols, rowMaps = QColumns.Merge([base, more], withRows=True)
+                self.assertEqual(list(cols.id), ["a", "b", "c", "d"])
+                self.assertEqual(list(rowMaps[0]), [0, -1, 2])
+                self.assertEqual(list(rowMaps[1]), [1, 3])
+
+
+CATALOG = os.path.join(os.path.dirname(__file__), "..", "data", "query2000.csv")
+
+
+class TestRefresh(unittest.TestCase):
+
+        def setUp(self):
+                self.dir = tempfile.mkdtemp()
+                self.path = os.path.join(self.dir, "feed.csv")
+                with open(CATALOG, "rb") as f:
+                        lines = f.read().splitlines()
+                self.header = lines[0]
+                self.rows = lines[1:]
+
+        def tearDown(self):
+                shutil.rmtree(self.dir)
+
+        def write(self, rows, tail=b""):
+                with open(self.path, "wb") as f:
+                        f.write(b"\n".join([self.header] + rows) + b"\n" + tail)
+                # a new mtime, as the stamp goes by size and mtime
+                os.utime(self.path, (0, len(rows)))
+
+        def test_bad_rows(self):
+                good = self.rows[0].split(b",")
+                bad = list(good)
+                bad[QDB.mag] = b"x"
+                cols = QColumns.FromRows([good, bad, good[:3]])
+                self.assertEqual(len(cols), 1)
+
+        def test_rewritten_feed(self):
+                self.write(self.rows[300:])
+                qdb = QDB(self.path)
+                qdb.Parse(useCache=False)
+                qdb.decluster()
+
+                # newest first: 300 new rows, one updated, one cut off mid write
+                updated = self.rows[1000].split(b",")
+                updated[QDB.updated] = b"2030-01-01T00:00:00.000Z"
+                rows = self.rows[:1000] + [b",".join(updated)] + self.rows[1001:]
+                self.write(rows, self.rows[0][:30])
+                self.assertEqual(qdb.refresh(), 301)
+
+                self.write(rows)
+                fresh = QDB(self.path)
+                fresh.Parse(useCache=False)
+                fresh.decluster()
+                a = qdb.Columns()
+                b = fresh.Columns()
+                np.testing.assert_array_equal(a.id, b.id)
+                np.testing.assert_array_equal(a.mainshock, b.mainshock)
+                # same clusters, whatever they are numbered
+                pairs = set(zip(a.cluster, b.cluster))
+                self.assertEqual(len(pairs), len(set(a.cluster)))
+                self.assertEqual(len(pairs), len(set(b.cluster)))
+                for lat, lon in ((35, 139), (-20, -70), (60, -150)):
+                        np.testing.assert_array_equal(a.sphereIndex.query(lat, lon, 15),
+                                                      b.sphereIndex.query(lat, lon, 15))
+
+
+if __name__ == "__main__":
+        unittest.main()